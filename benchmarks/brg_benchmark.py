@@ -0,0 +1,274 @@
+'''Benchmarks for reading and importing brg files, with a generator for synthetic models
+
+Without Blender only the parsing stages are timed:
+    python benchmarks/brg_benchmark.py --vertices 5000 --frames 100
+
+Inside Blender the import stages are timed as well:
+    blender -b -P benchmarks/brg_benchmark.py -- --vertices 5000 --frames 100'''
+
+import argparse
+import os
+import sys
+import time
+import shutil
+import tempfile
+import tracemalloc
+import numpy as np
+try:
+    import resource
+except ImportError: # windows
+    resource = None
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from io_scene_brg.brg_util import BufferedFile, Flag, MeshFlags, MatrFlags
+from io_scene_brg.brg_format import (FileHeader, AnimationHeader, Attachpoints, MeshFrame,
+                                     Material, BRGReader, BRGWriter)
+from io_scene_brg.brg_parallel import decode_frames
+try:
+    import bpy
+except ImportError:
+    bpy = None
+
+# synthetic model, a wobbling sphere of random triangles
+def synthetic_frame(rng, base, frame_id, frames, num_faces, matids, num_attachpoints):
+    '''the record of a single frame'''
+    phase = 2 * np.pi * frame_id / max(frames, 1)
+    wobble = 1.0 + 0.1 * np.sin(phase + base[:, 2] * 4)
+    frame = MeshFrame()
+    frame.version, frame.format = 22, 4
+    frame.num_vertices, frame.num_faces = len(base), num_faces
+    frame.vertices = (base * wobble[:, np.newaxis]).astype(np.float32)
+    frame.normals = base
+    frame.calc_bounds()
+    frame.unknown_vector = np.zeros(3, dtype=np.float32)
+    frame.ground_pos = np.zeros(3, dtype=np.float32)
+    frame.anim_time_mult = 1.0
+
+    props = MeshFlags.TEXTURE.value | MeshFlags.MATERIALS.value
+    if frame_id == 0:
+        num_vertices = len(base)
+        frame.uvs = rng.random((num_vertices, 2), dtype=np.float32)
+        frame.faces = rng.integers(0, num_vertices, (num_faces, 3)).astype(np.uint16)
+        frame.face_materials = matids[np.arange(num_faces) % len(matids)]
+        frame.vertex_materials = np.zeros(num_vertices, dtype=np.uint16)
+        frame.vertex_materials[frame.faces.ravel()] = np.repeat(frame.face_materials, 3)
+        frame.num_materials_used = len(matids)
+    else:
+        props |= MeshFlags.NOTFIRST.value
+
+    if num_attachpoints:
+        props |= MeshFlags.ATTACHPOINTS.value
+        points = Attachpoints()
+        points.num_matrix = num_attachpoints
+        points.matrices = np.tile(np.eye(4, dtype=np.float32), (num_attachpoints, 1, 1))
+        points.matrices[:, 2, 3] = np.arange(num_attachpoints) + np.sin(phase)
+        points.duplicates = [0] * (num_attachpoints - 1) + [1]
+        points.points = [0]
+        points.num_index = num_attachpoints
+        frame.attachpoints = points
+    frame.props = Flag(props)
+    return frame
+
+def write_synthetic(file_path, num_vertices = 5000, num_faces = 9000, frames = 100,
+                    num_materials = 2, num_attachpoints = 2, seed = 0):
+    '''write a synthetic brg file, frames are made one at a time'''
+    rng = np.random.default_rng(seed)
+    base = rng.normal(size=(num_vertices, 3)).astype(np.float32)
+    base /= np.linalg.norm(base, axis=1)[:, np.newaxis]
+    matids = np.arange(1000, 1000 + max(num_materials, 1), dtype=np.uint16)
+
+    file = BufferedFile(file_path)
+    writer = BRGWriter(file)
+    writer.write_section("BANG", FileHeader(num_materials, frames))
+    if frames > 1:
+        anim_time = frames / 30.0
+        writer.write_section("ASET", AnimationHeader(frames, anim_time, anim_time / frames, 30.0))
+    for frame_id in range(frames):
+        writer.write_section("MESI", synthetic_frame(rng, base, frame_id, frames,
+                                                     num_faces, matids, num_attachpoints))
+    for matid in matids[:num_materials]:
+        material = Material(int(matid), Flag(MatrFlags.MATNONE1.value | MatrFlags.MATTEXTURE.value))
+        material.texture_name = "synthetic %d" % matid
+        writer.write_section("MTRL", material)
+    file.close()
+    return file_path
+
+# stage timing
+class Stages:
+    def __init__(self):
+        self.times = {} # stage name to seconds
+        self.peaks = {} # stage name to peak traced memory in bytes
+
+    def run(self, name, function, *args):
+        '''time a stage and trace its python memory'''
+        tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            return function(*args)
+        finally:
+            self.add(name, time.perf_counter() - start)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            self.peaks[name] = max(self.peaks.get(name, 0), peak)
+
+    def add(self, name, seconds):
+        '''add time to a stage'''
+        self.times[name] = self.times.get(name, 0.0) + seconds
+
+    def wrap(self, obj, method, name):
+        '''time every call of a method of an object'''
+        original = getattr(obj, method)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                self.add(name, time.perf_counter() - start)
+        setattr(obj, method, timed)
+
+def scan(file_path):
+    '''index the sections of a file'''
+    reader = BRGReader(file_path)
+    try:
+        return reader.scan_sections()
+    finally:
+        reader.close()
+
+def decode(file_path):
+    '''decode every section'''
+    reader = BRGReader(file_path)
+    try:
+        return [section for head, section in reader.read_sections()]
+    finally:
+        reader.close()
+
+def pooled_decode(file_path, workers):
+    '''decode the frames in a process pool, whatever the size of the file'''
+    reader = BRGReader(file_path)
+    try:
+        return list(decode_frames(file_path, reader.frame_sections(), workers))
+    finally:
+        reader.close()
+
+# settings of the import operator and the addon preferences
+class ImportSettings:
+    filepath = ""
+    modify_fps = False
+    cyclic = True
+    frame_start = 1
+    frame_end = 0
+    frame_step = 1
+    point_cache = False
+
+    def report(self, kind, message):
+        print(message)
+
+class Preferences:
+    aom_path = ""
+    auto_import = False
+    native_ddt = True
+    comp_path = ""
+    glob_tex = False
+    tex_path = ""
+    workers = 0
+    diagnostics = False
+
+def blender_import(stages, file_path):
+    '''import a file in blender, splitting the time over the stages of the importer'''
+    from io_scene_brg.brg_import import BRGImporter, ImportCache
+    settings = ImportSettings()
+    importer = BRGImporter(bpy.context, settings, Preferences(), file_path, ImportCache())
+    sections = list(importer.reader.read_sections()) # decoding is timed on its own
+
+    # attachpoints are loaded from within the other stages, their time is taken out of them
+    stages.wrap(importer, "load_attachpoints", "attachpoints")
+    stages.wrap(importer, "load_attachpoint_animation", "attachpoints")
+    def run(stage, function, *args):
+        before = stages.times.get("attachpoints", 0.0)
+        start = time.perf_counter()
+        function(*args)
+        nested = stages.times.get("attachpoints", 0.0) - before
+        stages.add(stage, time.perf_counter() - start - nested)
+
+    for head, section in sections:
+        if head == "BANG":
+            importer.load_file_header(section)
+        elif head == "ASET":
+            importer.load_animation_header(section)
+        elif head == "MESI":
+            stage = "mesh build" if section.frame_id == 0 else "shape keys"
+            run(stage, importer.load_mesh, section, section.frame_id)
+        elif head == "MTRL":
+            run("materials", importer.load_materials, section)
+    run("finish", importer.finish_import)
+
+def benchmark_file(file_path, repeat, workers):
+    '''time the stages of reading and importing a file, the best of every repeat'''
+    best = None
+    for i in range(repeat):
+        stages = Stages()
+        sections = stages.run("section scan", scan, file_path)
+        stages.run("block decode", decode, file_path)
+        if workers > 1:
+            stages.run("pooled decode", pooled_decode, file_path, workers)
+        if bpy:
+            blender_import(stages, file_path)
+        if not best:
+            best = stages
+        else:
+            for name, seconds in stages.times.items():
+                best.times[name] = min(best.times[name], seconds)
+    return best, sections
+
+def report(file_path, stages, sections):
+    '''print the time, vertices per second and memory of every stage'''
+    frames = [s.header for s in sections if s.head == "MESI"]
+    num_vertices = frames[0].num_vertices if frames else 0
+    total_vertices = num_vertices * len(frames)
+    print("\n%s: %d vertices, %d faces, %d frames, %d sections" % (
+        os.path.basename(file_path), num_vertices, frames[0].num_faces if frames else 0,
+        len(frames), len(sections)))
+    print("%-16s %10s %16s %12s" % ("stage", "seconds", "vertices/s", "peak MB"))
+    for name, seconds in stages.times.items():
+        count = num_vertices if name == "mesh build" else total_vertices
+        rate = count / seconds if seconds > 0 else float('inf')
+        peak = stages.peaks.get(name)
+        print("%-16s %10.4f %16.0f %12s" % (name, seconds, rate,
+              "%.1f" % (peak / 1e6) if peak is not None else "-"))
+
+def main(argv = None):
+    if argv is None: # arguments after -- when started by blender
+        argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else sys.argv[1:]
+    parser = argparse.ArgumentParser(description="Time the stages of reading and importing brg files.")
+    parser.add_argument("files", nargs="*", help="brg files to time, a synthetic file is made without them")
+    parser.add_argument("--vertices", type=int, default=5000)
+    parser.add_argument("--faces", type=int, default=9000)
+    parser.add_argument("--frames", type=int, default=100)
+    parser.add_argument("--materials", type=int, default=2)
+    parser.add_argument("--attachpoints", type=int, default=2)
+    parser.add_argument("--repeat", type=int, default=3, help="keep the best time of this many runs")
+    parser.add_argument("--workers", type=int, default=0, help="also time decoding in a process pool")
+    parser.add_argument("--keep", help="folder to keep the synthetic file in")
+    args = parser.parse_args(argv)
+
+    folder = args.keep or tempfile.mkdtemp(prefix="brg_benchmark")
+    files = args.files
+    try:
+        if not files:
+            name = "synthetic_%dv_%df_%dfr.brg" % (args.vertices, args.faces, args.frames)
+            start = time.perf_counter()
+            files = [write_synthetic(os.path.join(folder, name), args.vertices, args.faces,
+                args.frames, args.materials, args.attachpoints)]
+            print("Generated %s in %.3fs" % (name, time.perf_counter() - start))
+        for file_path in files:
+            stages, sections = benchmark_file(file_path, args.repeat, args.workers)
+            report(file_path, stages, sections)
+        if resource:
+            maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            print("\npeak process memory: %.1f MB" % (maxrss / (1e6 if sys.platform == "darwin" else 1e3)))
+    finally:
+        if not args.keep:
+            shutil.rmtree(folder, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -32,179 +32,398 @@ bl_info = {
 
 
 #modules
-import bpy
 import os,sys
-from . import brg_import, brg_export, brg_util
-from importlib import reload
-from bpy.props import *
-from bpy_extras.io_utils import ExportHelper, ImportHelper
-from bpy.types import Operator, AddonPreferences
-from bpy.props import StringProperty, IntProperty, BoolProperty
-
-# addon preferences in blender user preferences
-class AoMPreferences(AddonPreferences):
-    bl_idname = __name__
-
-    aom_path = StringProperty(
-            name="Path to Age of Mythology Installation",
-            subtype='FILE_PATH',
-            )
-    auto_import = BoolProperty(
-            name="Autmatically import images from AoM",
-            default=True,
-            )
-    comp_path = StringProperty(
-            name="Path to TextureExtractor.exe. (v2)",
-            subtype='FILE_PATH',
-            )
-    glob_tex = BoolProperty(
-            name="Default save converted textures globally. Default \"\\[AoM]\\Textures\\Converted\".",
-            default=True,
-            )
-    tex_path = StringProperty(
-            name="Path for global texture conversion storage.",
-            subtype='FILE_PATH',
-            )
-
-    def draw(self, context):
-        layout = self.layout
-        layout.label(text="Edit here your preferences to use the addon to it's fullest potential.")
-        layout.prop(self, "auto_import")
-        layout.prop(self, "aom_path")
-        layout.prop(self, "comp_path")
-        layout.prop(self, "glob_tex")
-        layout.prop(self, "tex_path")
-
-#import function
-class IMPORT_BRG(bpy.types.Operator, ImportHelper):
-    '''Import brg model files from Age of Mythology'''
-    bl_idname = "import_scene.brg"
-    bl_description = "Import AoM Model"
-    bl_label = "Import AoM Model"
-    filename_ext = ".brg"
-    filter_glob = StringProperty(default="*.brg", options={'HIDDEN'})
-
-    filepath = StringProperty(name="File Path",
-        description="Filepath used for importing the brg file",
-        maxlen=1024, default="")
-
-    modify_fps = BoolProperty(
-            name="Modify frame settings",
-            default=False,
-            )
-    cyclic = BoolProperty(
-            name="Cyclic animation",
-            default=True,
-            )
-
-    def execute(self, context):
-        preferences = context.user_preferences
-        addon_prefs = preferences.addons[__name__].preferences
-        importer = brg_import.BRGImporter(context, self, addon_prefs)
-
-        frame_id = 0 # id for the frame numbers needed for animated objects
-        # scan for headers,
-        # when one is found, read all the data for the header
-        # and scan for the next
-        head = importer.read_section_head()
-        while head: # reading loop
-            print("\n######### Reading:", head,"#########")
-
-            if head == "BANG": #Main file header
-                importer.read_file_header()
-            elif head == "ASET": #Animation definition
-                importer.read_animation_header()
-            elif head == "MESI": #Mesh data
-                importer.read_mesh(frame_id)
-                frame_id += 1
-            elif head == "MTRL": #Material settings
-                importer.read_materials()
+import time
+import multiprocessing
+try:
+    import bpy
+except ImportError: # loaded outside of Blender, only brg_format can be used
+    bpy = None
+
+if bpy:
+    from . import (brg_import, brg_export, brg_util, brg_format, brg_parallel, brg_ddt,
+                   brg_convert, brg_validate, brg_catalog)
+    from importlib import reload
+    from bpy.props import *
+    from bpy_extras.io_utils import ExportHelper, ImportHelper
+    from bpy.types import Operator, AddonPreferences, OperatorFileListElement, Panel, PropertyGroup
+    from bpy.props import StringProperty, IntProperty, FloatProperty, BoolProperty, CollectionProperty, PointerProperty
+
+    # addon preferences in blender user preferences
+    class AoMPreferences(AddonPreferences):
+        bl_idname = __name__
+
+        aom_path = StringProperty(
+                name="Path to Age of Mythology Installation",
+                subtype='FILE_PATH',
+                )
+        auto_import = BoolProperty(
+                name="Autmatically import images from AoM",
+                default=True,
+                )
+        native_ddt = BoolProperty(
+                name="Decode .ddt textures inside Blender. TextureExtractor is only used when this fails.",
+                default=True,
+                )
+        comp_path = StringProperty(
+                name="Path to TextureExtractor.exe. (v2)",
+                subtype='FILE_PATH',
+                )
+        glob_tex = BoolProperty(
+                name="Default save converted textures globally. Default \"\\[AoM]\\Textures\\Converted\".",
+                default=True,
+                )
+        tex_path = StringProperty(
+                name="Path for global texture conversion storage.",
+                subtype='FILE_PATH',
+                )
+        workers = IntProperty(
+                name="Worker processes for decoding animation frames, only used from 2 million vertices over all frames. 0 decodes inside Blender.",
+                default=0, min=0, max=64,
+                )
+        diagnostics = BoolProperty(
+                name="Diagnostics: time every section and write a json report of every import and export.",
+                default=False,
+                )
+
+        def draw(self, context):
+            layout = self.layout
+            layout.label(text="Edit here your preferences to use the addon to it's fullest potential.")
+            layout.prop(self, "auto_import")
+            layout.prop(self, "aom_path")
+            layout.prop(self, "native_ddt")
+            layout.prop(self, "comp_path")
+            layout.prop(self, "glob_tex")
+            layout.prop(self, "tex_path")
+            layout.prop(self, "workers")
+            layout.prop(self, "diagnostics")
+
+    def report_stats(operator, kind):
+        '''write the recorded timings to a json report and show a summary'''
+        stats = brg_util.stats
+        if not stats.enabled:
+            return
+        path = stats.write_json(brg_util.report_path(stats.name, kind))
+        operator.report({'INFO'}, stats.summary() + ", report: " + path)
+
+    #import function
+    class IMPORT_BRG(bpy.types.Operator, ImportHelper):
+        '''Import brg model files from Age of Mythology'''
+        bl_idname = "import_scene.brg"
+        bl_description = "Import AoM Model"
+        bl_label = "Import AoM Model"
+        filename_ext = ".brg"
+        filter_glob = StringProperty(default="*.brg", options={'HIDDEN'})
+
+        filepath = StringProperty(name="File Path",
+            description="Filepath used for importing the brg file",
+            maxlen=1024, default="")
+        files = CollectionProperty(
+                name="File Path",
+                type=OperatorFileListElement,
+                )
+        directory = StringProperty(
+                subtype='DIR_PATH',
+                )
+
+        import_folder = BoolProperty(
+                name="Import whole folder",
+                description="Import every brg file in the folder",
+                default=False,
+                )
+        modify_fps = BoolProperty(
+                name="Modify frame settings",
+                default=False,
+                )
+        cyclic = BoolProperty(
+                name="Cyclic animation",
+                default=True,
+                )
+        frame_start = IntProperty(
+                name="Start frame",
+                description="First frame of the animation to import",
+                default=1, min=1,
+                )
+        frame_end = IntProperty(
+                name="End frame",
+                description="Last frame of the animation to import, 0 for the last frame of the file",
+                default=0, min=0,
+                )
+        frame_step = IntProperty(
+                name="Frame step",
+                description="Import only every n-th frame of the animation",
+                default=1, min=1,
+                )
+        point_cache = BoolProperty(
+                name="Animation as point cache",
+                description="Stream the frames to a .pc2 file next to the model, played by a Mesh Cache modifier, instead of a shape key per frame",
+                default=False,
+                )
+
+        def execute(self, context):
+            preferences = context.user_preferences
+            addon_prefs = preferences.addons[__name__].preferences
+            file_paths = self.get_file_paths()
+            name = os.path.splitext(os.path.basename(file_paths[0]))[0]
+            brg_util.stats.begin(name, addon_prefs.diagnostics)
+            if len(file_paths) > 1:
+                return self.execute_batch(context, addon_prefs, file_paths)
+
+            brg_import.import_cache.start_batch()
+            # an identical file imported before becomes a linked duplicate
+            key = brg_import.import_key(file_paths[0], self)
+            if brg_import.link_instance(context, key):
+                report_stats(self, "import")
+                return {'FINISHED'}
+
+            importer = brg_import.BRGImporter(context, self, addon_prefs, file_paths[0])
+            importer.prepare_textures(importer.reader.read_material_records())
+
+            # parse the file section by section,
+            # and turn every parsed record into blender data
+            # frames outside of the imported range are not decoded
+            # with workers set, the frames are decoded in a process pool
+            sections = importer.reader.read_sections(importer.use_frame, addon_prefs.workers)
+            try:
+                importer.load_sections(sections)
+                importer.finish_import()
+            except:
+                importer.cancel_import()
+                raise
+
+            report_stats(self, "import")
+            return {'FINISHED'}
+
+        def execute_batch(self, context, addon_prefs, file_paths):
+            '''import many files with shared caches and report the results'''
+            start = time.time()
+            brg_util.stats.name = os.path.basename(os.path.dirname(file_paths[0])) + "_batch"
+            results = brg_import.import_files(context, self, addon_prefs, file_paths)
+
+            failed = 0
+            for path, parse_time, build_time, error in results:
+                name = os.path.basename(path)
+                if error:
+                    failed += 1
+                    print("FAILED %s: %s" % (name, error))
+                else:
+                    print("%s: parse %.3fs, build %.3fs" % (name, parse_time, build_time))
+
+            summary = "Imported %d of %d files in %.1fs" % (
+                len(results) - failed, len(results), time.time() - start)
+            if failed:
+                self.report({'WARNING'}, summary + ", %d failed (see console)" % failed)
             else:
-                break
-
-            head = importer.read_section_head()
-        importer.finish_import()
-
-        return {'FINISHED'}
-
-    def invoke(self, context, event):
-        context.window_manager.fileselect_add(self)
-        return {'RUNNING_MODAL'}
-
-    def draw(self, context):
-        layout = self.layout
-        layout.prop(self, "modify_fps")
-        layout.prop(self, "cyclic")
-
-#export function
-class EXPORT_BRG(bpy.types.Operator, ExportHelper):
-    '''Export brg model files for Age of Mythology'''
-    bl_idname = "export_scene.brg"
-    bl_description = "Export AoM Model"
-    bl_label = "Export AoM Model"
-    filename_ext = ".brg"
-    filter_glob = StringProperty(default="*.brg", options={'HIDDEN'})
-
-    filepath = StringProperty(name="File Path",
-        description="Filepath used for importing the brg file",
-        maxlen=1024, default="")
-
-    def execute(self, context):
-        preferences = context.user_preferences
-        addon_prefs = preferences.addons[__name__].preferences
-        exporter = brg_export.BRGExporter(context, self, addon_prefs)
-
-        frame_id = 0 # id for the frame numbers needed for animated objects
-        # scan for headers,
-        # when one is found, read all the data for the header
-        # and scan for the next
-        section_heads = exporter.get_section_heads()
-        for head in section_heads: # reading loop
-            print("\n######### Reading:", head,"#########")
-            exporter.write_section_head(head)
-
-            if head == "BANG": #Main file header
-                if not exporter.write_file_header():
-                    return {'FINISHED'}
-            elif head == "ASET": #Animation definition
-                exporter.write_animation_header()
-            elif head == "MESI": #Mesh data
-                exporter.write_mesh(frame_id)
-                frame_id += 1
-            elif head == "MTRL": #Material settings
-                exporter.write_materials()
-
-        exporter.finish_export()
-
-        return {'FINISHED'}
-
-    def invoke(self, context, event):
-        context.window_manager.fileselect_add(self)
-        return {'RUNNING_MODAL'}
-
-#menu registers
-def menu_func_import(self, context):
-    self.layout.operator(IMPORT_BRG.bl_idname, text="Age of Mythology (.brg)")
-
-def menu_func_export(self, context):
-    self.layout.operator(EXPORT_BRG.bl_idname, text="Age of Mythology (.brg)")
-
-def register():
-    bpy.utils.register_module(__name__)
-    reload_scripts()
-    os.system('cls') # clear the cmd, temponary for debug
-    bpy.types.INFO_MT_file_import.append(menu_func_import)
-    bpy.types.INFO_MT_file_export.append(menu_func_export)
-
-def unregister():
-    bpy.utils.unregister_module(__name__)
-    bpy.types.INFO_MT_file_import.remove(menu_func_import)
-    bpy.types.INFO_MT_file_export.remove(menu_func_export)
-
-def reload_scripts(): # reload all subscripts when reloading main script
-    reload(brg_util)
-    reload(brg_import)
-    reload(brg_export)
+                self.report({'INFO'}, summary)
+            report_stats(self, "import")
+            return {'FINISHED'}
+
+        def get_file_paths(self):
+            '''collect the selected files, or all brg files of the folder'''
+            directory = self.directory or os.path.dirname(self.filepath)
+            if self.import_folder:
+                names = sorted(n for n in os.listdir(directory) if n.lower().endswith(".brg"))
+            else:
+                names = [f.name for f in self.files if f.name]
+            if not names:
+                return [self.filepath]
+            return [os.path.join(directory, n) for n in names]
+
+        def invoke(self, context, event):
+            context.window_manager.fileselect_add(self)
+            return {'RUNNING_MODAL'}
+
+        def draw(self, context):
+            layout = self.layout
+            layout.prop(self, "import_folder")
+            layout.prop(self, "modify_fps")
+            layout.prop(self, "cyclic")
+            layout.prop(self, "frame_start")
+            layout.prop(self, "frame_end")
+            layout.prop(self, "frame_step")
+            layout.prop(self, "point_cache")
+
+    #export function
+    class EXPORT_BRG(bpy.types.Operator, ExportHelper):
+        '''Export brg model files for Age of Mythology'''
+        bl_idname = "export_scene.brg"
+        bl_description = "Export AoM Model"
+        bl_label = "Export AoM Model"
+        filename_ext = ".brg"
+        filter_glob = StringProperty(default="*.brg", options={'HIDDEN'})
+
+        filepath = StringProperty(name="File Path",
+            description="Filepath used for exporting the brg file",
+            maxlen=1024, default="")
+
+        def execute(self, context):
+            preferences = context.user_preferences
+            addon_prefs = preferences.addons[__name__].preferences
+            name = os.path.splitext(os.path.basename(self.filepath))[0]
+            brg_util.stats.begin(name, addon_prefs.diagnostics)
+            exporter = brg_export.BRGExporter(context, self, addon_prefs)
+            if not exporter.model:
+                return {'CANCELLED'}
+            with brg_util.stats.stage("prepare"):
+                exporter.prepare_animation()
+                if not exporter.prepare_mesh():
+                    exporter.cancel_export()
+                    return {'CANCELLED'}
+                exporter.prepare_attachpoints()
+
+            # every frame is evaluated, encoded and written before the next one
+            try:
+                exporter.write_sections()
+            except:
+                exporter.cancel_export()
+                raise
+            exporter.finish_export()
+
+            report_stats(self, "export")
+            return {'FINISHED'}
+
+        def invoke(self, context, event):
+            context.window_manager.fileselect_add(self)
+            return {'RUNNING_MODAL'}
+
+    #catalog of the models of the AoM installation
+    class CatalogEntry(PropertyGroup):
+        path = StringProperty(subtype='FILE_PATH')
+        frames = IntProperty()
+        vertices = IntProperty()
+        attachpoints = IntProperty()
+        anim_time = FloatProperty()
+
+    class CatalogSettings(PropertyGroup):
+        name = StringProperty(
+                name="Name",
+                description="Part of the file path, * matches anything",
+                )
+        texture = StringProperty(
+                name="Texture",
+                description="Texture name used by a material of the model, * matches anything",
+                )
+        min_frames = IntProperty(
+                name="Minimum frames",
+                default=0, min=0,
+                )
+        attachpoints = BoolProperty(
+                name="With attachpoints",
+                default=False,
+                )
+        results = CollectionProperty(type=CatalogEntry)
+
+    def open_catalog(context):
+        addon_prefs = context.user_preferences.addons[__name__].preferences
+        if not addon_prefs.aom_path or not os.path.isdir(addon_prefs.aom_path):
+            return None, addon_prefs
+        path = brg_catalog.catalog_path(bpy.path.abspath(addon_prefs.aom_path))
+        return brg_catalog.Catalog(path), addon_prefs
+
+    class CATALOG_REFRESH(bpy.types.Operator):
+        '''Parse the new and changed models of the AoM installation into the catalog'''
+        bl_idname = "brg.catalog_refresh"
+        bl_label = "Refresh Catalog"
+
+        def execute(self, context):
+            catalog, addon_prefs = open_catalog(context)
+            if not catalog:
+                self.report({'ERROR'}, "Specify the AoM installation in the preferences")
+                return {'CANCELLED'}
+            # workers parsing the files are started with python, not with blender
+            if addon_prefs.workers > 1:
+                multiprocessing.set_executable(bpy.app.binary_path_python)
+            try:
+                folder = brg_catalog.models_folder(bpy.path.abspath(addon_prefs.aom_path))
+                updated, removed, unchanged = catalog.refresh(folder, addon_prefs.workers)
+            finally:
+                catalog.close()
+            self.report({'INFO'}, "Catalog refreshed: %d updated, %d removed, %d unchanged" % (
+                updated, removed, unchanged))
+            return {'FINISHED'}
+
+    class CATALOG_SEARCH(bpy.types.Operator):
+        '''Find the models in the catalog matching the search settings'''
+        bl_idname = "brg.catalog_search"
+        bl_label = "Search Catalog"
+
+        def execute(self, context):
+            catalog, addon_prefs = open_catalog(context)
+            if not catalog:
+                self.report({'ERROR'}, "Specify the AoM installation in the preferences")
+                return {'CANCELLED'}
+            settings = context.scene.brg_catalog
+            try:
+                entries = catalog.find(settings.name, settings.texture, settings.min_frames,
+                                       settings.attachpoints, limit=500)
+            finally:
+                catalog.close()
+            settings.results.clear()
+            for entry in entries:
+                result = settings.results.add()
+                result.name = os.path.basename(entry["path"])
+                result.path = entry["path"]
+                result.frames = entry["frames"]
+                result.vertices = entry["vertices"]
+                result.attachpoints = entry["attachpoints"]
+                result.anim_time = entry["anim_time"]
+            self.report({'INFO'}, "%d models found" % len(entries))
+            return {'FINISHED'}
+
+    class CatalogPanel(Panel):
+        '''Search the catalog and import the models found'''
+        bl_label = "AoM Model Catalog"
+        bl_space_type = 'VIEW_3D'
+        bl_region_type = 'TOOLS'
+        bl_category = "AoM"
+
+        def draw(self, context):
+            layout = self.layout
+            settings = context.scene.brg_catalog
+            layout.operator(CATALOG_REFRESH.bl_idname, icon='FILE_REFRESH')
+            layout.prop(settings, "name")
+            layout.prop(settings, "texture")
+            layout.prop(settings, "min_frames")
+            layout.prop(settings, "attachpoints")
+            layout.operator(CATALOG_SEARCH.bl_idname, icon='VIEWZOOM')
+
+            column = layout.column(align=True)
+            column.operator_context = 'EXEC_DEFAULT' # import without the file browser
+            for result in settings.results:
+                row = column.row(align=True)
+                row.label(text="%s (%d frames)" % (result.name, result.frames))
+                row.operator(IMPORT_BRG.bl_idname, text="", icon='IMPORT').filepath = result.path
+
+    #menu registers
+    def menu_func_import(self, context):
+        self.layout.operator(IMPORT_BRG.bl_idname, text="Age of Mythology (.brg)")
+
+    def menu_func_export(self, context):
+        self.layout.operator(EXPORT_BRG.bl_idname, text="Age of Mythology (.brg)")
+
+    def register():
+        bpy.utils.register_module(__name__)
+        reload_scripts()
+        bpy.types.Scene.brg_catalog = PointerProperty(type=CatalogSettings)
+        bpy.types.INFO_MT_file_import.append(menu_func_import)
+        bpy.types.INFO_MT_file_export.append(menu_func_export)
+
+    def unregister():
+        bpy.utils.unregister_module(__name__)
+        del bpy.types.Scene.brg_catalog
+        bpy.types.INFO_MT_file_import.remove(menu_func_import)
+        bpy.types.INFO_MT_file_export.remove(menu_func_export)
+
+    def reload_scripts(): # reload all subscripts when reloading main script
+        reload(brg_ddt)
+        reload(brg_util)
+        reload(brg_format)
+        reload(brg_parallel)
+        reload(brg_convert) # before brg_catalog and brg_import, they use it
+        reload(brg_validate)
+        reload(brg_catalog)
+        reload(brg_import)
+        reload(brg_export)
 
 if __name__ == "__main__":
     register()
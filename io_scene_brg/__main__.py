@@ -0,0 +1,64 @@
+import argparse
+import os
+import sys
+import time
+from .brg_convert import WRITERS, find_files, output_paths, convert_files
+from .brg_validate import check_files, write_report
+
+'''Command line converter for brg files, runs without Blender
+
+python -m io_scene_brg -f gltf -o converted models/
+python -m io_scene_brg --check report.json models/'''
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(prog="python -m io_scene_brg",
+        description="Convert Age of Mythology brg models without Blender.")
+    parser.add_argument("inputs", nargs="+",
+        help="brg files or folders to search for brg files")
+    parser.add_argument("-o", "--output", default=".",
+        help="folder for the converted files")
+    parser.add_argument("-f", "--format", choices=sorted(WRITERS), default="gltf",
+        help="gltf with morph targets, an obj per frame, a compressed npz or a pc2 point cache")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1,
+        help="number of worker processes")
+    parser.add_argument("--check", metavar="REPORT",
+        help="only check the structure of the files and write a json report, - for stdout")
+    args = parser.parse_args(argv)
+
+    start = time.time()
+    file_paths = find_files(args.inputs)
+    if args.check:
+        return check(file_paths, args.check, args.jobs, start)
+    try:
+        output_paths(file_paths, args.output)
+    except ValueError as e:
+        parser.error(str(e))
+    failed = 0
+    for path, error in convert_files(file_paths, args.output, args.format, args.jobs):
+        if error:
+            failed += 1
+            print("FAILED %s: %s" % (path, error), file=sys.stderr)
+        else:
+            print(path)
+    print("Converted %d of %d files in %.1fs" % (
+        len(file_paths) - failed, len(file_paths), time.time() - start))
+    return 1 if failed else 0
+
+def check(file_paths, report_path, jobs, start):
+    '''check the files and write the report, the failures are listed on stderr'''
+    results = list(check_files(file_paths, jobs))
+    for result in results:
+        for error in result["errors"]:
+            print("FAILED %s: %s" % (result["file"], error), file=sys.stderr)
+    if report_path == "-":
+        summary = write_report(results, sys.stdout)
+    else:
+        with open(report_path, 'w') as out:
+            summary = write_report(results, out)
+    print("Checked %d files in %.1fs, %d failed, %d with warnings" % (
+        summary["files"], time.time() - start, summary["failed"], summary["warned"]),
+        file=sys.stderr)
+    return 1 if summary["failed"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,204 @@
+import os
+import sys
+import json
+import sqlite3
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from .brg_format import BRGReader
+from .brg_convert import find_files
+
+'''Catalog of the header data of a library of brg files in sqlite, runs without Blender
+
+Files are only parsed again when their modification time or size changed.
+
+python -m io_scene_brg.brg_catalog path/to/aom --refresh --attachpoints --min-frames 40'''
+
+CATALOG_NAME = "brg_catalog.sqlite"
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    mtime REAL, size INTEGER,
+    vertices INTEGER, faces INTEGER, frames INTEGER, anim_time REAL,
+    mesh_flags INTEGER, attachpoints INTEGER, materials INTEGER,
+    error TEXT);
+CREATE TABLE IF NOT EXISTS materials (
+    path TEXT, matid INTEGER, flags INTEGER, texture TEXT);
+CREATE INDEX IF NOT EXISTS materials_path ON materials (path);
+CREATE INDEX IF NOT EXISTS materials_texture ON materials (texture COLLATE NOCASE);
+'''
+
+COLUMNS = ("path", "vertices", "faces", "frames", "anim_time",
+           "mesh_flags", "attachpoints", "materials", "error")
+
+def catalog_path(aom_path):
+    '''the catalog file of an AoM installation'''
+    return os.path.join(aom_path, CATALOG_NAME)
+
+def models_folder(aom_path):
+    '''the folder holding the models of an AoM installation'''
+    folder = os.path.join(aom_path, "models")
+    return folder if os.path.isdir(folder) else aom_path
+
+def read_metadata(file_path):
+    '''header data of a file, the arrays of the frames are skipped'''
+    info = dict((name, 0) for name in COLUMNS)
+    info["path"], info["error"], info["anim_time"] = file_path, None, 0.0
+    materials = []
+    try:
+        reader = BRGReader(file_path)
+        try:
+            for section in reader.scan_sections():
+                if section.head == "ASET":
+                    info["anim_time"] = reader.read_section(section).anim_time
+                elif section.head == "MESI":
+                    frame = section.header
+                    if not info["frames"]:
+                        info["vertices"], info["faces"] = frame.num_vertices, frame.num_faces
+                        info["mesh_flags"] = frame.props.value
+                        if frame.attachpoints:
+                            info["attachpoints"] = frame.attachpoints.num_matrix
+                    info["frames"] += 1
+                elif section.head == "MTRL":
+                    material = reader.read_section(section)
+                    materials.append((material.matid, material.props.value,
+                                      material.texture_name or ""))
+        finally:
+            reader.close()
+    except Exception as e: # broken files are kept with their error
+        info["error"] = "%s: %s" % (type(e).__name__, e)
+    info["materials"] = len(materials)
+    return info, materials
+
+class Catalog:
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.folder = os.path.dirname(os.path.abspath(db_path))
+        self.db = sqlite3.connect(db_path)
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def relative(self, file_path):
+        '''paths are kept relative to the catalog, so the installation can move'''
+        return os.path.relpath(os.path.abspath(file_path), self.folder)
+
+    def absolute(self, path):
+        return os.path.normpath(os.path.join(self.folder, path))
+
+    def refresh(self, folder, workers = 1):
+        '''parse new and changed files and forget removed ones,
+        returns the number of updated, removed and unchanged files'''
+        known = dict((row[0], (row[1], row[2]))
+                     for row in self.db.execute("SELECT path, mtime, size FROM files"))
+        found, changed = {}, []
+        for file_path in find_files([folder]):
+            stat = os.stat(file_path)
+            path = self.relative(file_path)
+            found[path] = (stat.st_mtime, stat.st_size)
+            if known.get(path) != found[path]:
+                changed.append(file_path)
+        removed = [path for path in known if path not in found]
+
+        # files are small and many, so they are handed out in chunks
+        if workers > 1 and len(changed) > workers:
+            pool = ProcessPoolExecutor(max_workers=workers)
+            chunksize = max(1, min(64, len(changed) // (workers * 4)))
+            results = pool.map(read_metadata, changed, chunksize=chunksize)
+        else:
+            pool = None
+            results = map(read_metadata, changed)
+
+        try:
+            with self.db:
+                for path in removed:
+                    self.forget(path)
+                for info, materials in results:
+                    path = self.relative(info["path"])
+                    self.forget(path)
+                    mtime, size = found[path]
+                    self.db.execute("INSERT INTO files VALUES (?,?,?,?,?,?,?,?,?,?,?)",
+                        (path, mtime, size, info["vertices"], info["faces"], info["frames"],
+                         info["anim_time"], info["mesh_flags"], info["attachpoints"],
+                         info["materials"], info["error"]))
+                    self.db.executemany("INSERT INTO materials VALUES (?,?,?,?)",
+                        [(path,) + material for material in materials])
+        finally:
+            if pool:
+                pool.shutdown()
+        return len(changed), len(removed), len(found) - len(changed)
+
+    def forget(self, path):
+        '''remove a file from the catalog'''
+        self.db.execute("DELETE FROM files WHERE path = ?", (path,))
+        self.db.execute("DELETE FROM materials WHERE path = ?", (path,))
+
+    def find(self, name = None, texture = None, min_frames = 0, attachpoints = False,
+             broken = False, limit = None):
+        '''files matching all given conditions, * can be used in the name and texture'''
+        conditions, values = [], []
+        if name:
+            conditions.append("f.path LIKE ?")
+            values.append("%" + name.replace("*", "%") + "%")
+        if texture:
+            conditions.append("f.path IN (SELECT path FROM materials WHERE texture LIKE ?)")
+            values.append(texture.replace("*", "%"))
+        if min_frames:
+            conditions.append("f.frames >= ?")
+            values.append(min_frames)
+        if attachpoints:
+            conditions.append("f.attachpoints > 0")
+        if broken:
+            conditions.append("f.error IS NOT NULL")
+        sql = "SELECT %s FROM files f" % ", ".join("f." + c for c in COLUMNS)
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY f.path"
+        if limit:
+            sql += " LIMIT %d" % limit
+
+        entries = []
+        for row in self.db.execute(sql, values):
+            entry = dict(zip(COLUMNS, row))
+            entry["path"] = self.absolute(entry["path"])
+            entries.append(entry)
+        return entries
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(prog="python -m io_scene_brg.brg_catalog",
+        description="Catalog and search the brg models of an Age of Mythology installation.")
+    parser.add_argument("aom_path", help="the AoM installation, the catalog is kept in it")
+    parser.add_argument("--refresh", action="store_true",
+        help="parse new and changed files first")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1,
+        help="number of worker processes for refreshing")
+    parser.add_argument("--name", help="part of the file path")
+    parser.add_argument("--texture", help="texture name used by a material")
+    parser.add_argument("--min-frames", type=int, default=0)
+    parser.add_argument("--attachpoints", action="store_true", help="only files with attachpoints")
+    parser.add_argument("--broken", action="store_true", help="only files that failed to parse")
+    parser.add_argument("--json", action="store_true", help="print the matches as json")
+    args = parser.parse_args(argv)
+
+    catalog = Catalog(catalog_path(args.aom_path))
+    try:
+        if args.refresh:
+            updated, removed, unchanged = catalog.refresh(models_folder(args.aom_path), args.jobs)
+            print("Catalog refreshed: %d updated, %d removed, %d unchanged" % (
+                updated, removed, unchanged), file=sys.stderr)
+        entries = catalog.find(args.name, args.texture, args.min_frames,
+                               args.attachpoints, args.broken)
+    finally:
+        catalog.close()
+
+    if args.json:
+        json.dump(entries, sys.stdout, indent=1)
+    else:
+        for entry in entries:
+            print("%s: %d vertices, %d faces, %d frames, %d attachpoints" % (entry["path"],
+                  entry["vertices"], entry["faces"], entry["frames"], entry["attachpoints"]))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,292 @@
+import os
+import io
+import json
+import struct
+import zipfile
+from urllib.parse import quote
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from .brg_format import BRGReader
+
+'''Conversion of brg files to other formats without Blender, one frame at a time'''
+
+def to_y_up(vectors):
+    '''rotate blender space vectors (z up) to y up'''
+    return np.ascontiguousarray(np.stack((vectors[:, 0], vectors[:, 2], -vectors[:, 1]), axis=1))
+
+# compressed numpy archive with one entry per array of every frame
+class NPZWriter:
+    def __init__(self, out_path):
+        self.zip = zipfile.ZipFile(out_path + '.npz', 'w', zipfile.ZIP_DEFLATED)
+
+    def write_array(self, name, array):
+        '''add a single array to the archive'''
+        data = io.BytesIO()
+        np.lib.format.write_array(data, np.asarray(array))
+        self.zip.writestr(name + '.npy', data.getvalue())
+
+    def add_frame(self, frame, animation):
+        '''write the arrays of a frame'''
+        if frame.first_frame:
+            self.write_array('uvs', frame.uvs)
+            self.write_array('faces', frame.faces)
+            self.write_array('face_materials', frame.face_materials)
+            if frame.colors is not None:
+                self.write_array('colors', frame.colors)
+        prefix = 'frame_%04d_' % frame.frame_id
+        self.write_array(prefix + 'vertices', frame.vertices)
+        self.write_array(prefix + 'normals', frame.normals)
+        if frame.attachpoints:
+            self.write_array(prefix + 'attachpoints', frame.attachpoints.matrices)
+
+    def finish(self, animation, materials):
+        '''write the frame settings and materials and close the archive'''
+        if animation:
+            self.write_array('anim_time', animation.anim_time)
+        self.write_array('material_ids', [m.matid for m in materials])
+        self.write_array('texture_names', [m.texture_name for m in materials])
+        self.zip.close()
+
+# wavefront obj file for every frame, faces grouped by material id
+class OBJWriter:
+    def __init__(self, out_path):
+        self.out_path = out_path
+
+    def add_frame(self, frame, animation):
+        '''write a frame to its own obj file'''
+        if frame.first_frame:
+            # topology is shared by all frames, faces sorted by material
+            order = np.argsort(frame.face_materials, kind='mergesort')
+            self.face_materials = frame.face_materials[order]
+            self.faces = frame.faces[order].astype(np.int64) + 1
+            self.uvs = frame.uvs
+
+        path = self.out_path + ('_%04d.obj' % frame.frame_id if animation else '.obj')
+        with open(path, 'w') as obj:
+            obj.write("# Converted from Age of Mythology brg\n")
+            np.savetxt(obj, to_y_up(frame.vertices), fmt='v %.6f %.6f %.6f')
+            np.savetxt(obj, self.uvs, fmt='vt %.6f %.6f')
+            np.savetxt(obj, to_y_up(frame.normals), fmt='vn %.6f %.6f %.6f')
+
+            # one usemtl block for every material id
+            matids, starts = np.unique(self.face_materials, return_index=True)
+            ends = list(starts[1:]) + [len(self.faces)]
+            for matid, start, end in zip(matids, starts, ends):
+                obj.write("usemtl %d\n" % matid)
+                faces = np.repeat(self.faces[start:end], 3, axis=1)
+                np.savetxt(obj, faces, fmt='f %d/%d/%d %d/%d/%d %d/%d/%d')
+
+    def finish(self, animation, materials):
+        pass
+
+# gltf 2.0 with every frame as a morph target, the binary is appended frame by frame
+class GLTFWriter:
+    def __init__(self, out_path):
+        self.out_path = out_path
+        self.bin = open(out_path + '.bin', 'wb')
+        self.offset = 0
+        self.gltf = {
+            "asset": {"version": "2.0", "generator": "io_scene_brg"},
+            "scene": 0,
+            "scenes": [{"nodes": [0]}],
+            "nodes": [{"mesh": 0, "name": os.path.basename(out_path)}],
+            "buffers": [],
+            "bufferViews": [],
+            "accessors": [],
+            }
+        self.primitive = {"attributes": {}, "targets": []}
+        self.frame_ids = []
+
+    def add_accessor(self, array, component, kind, target = None, bounds = False):
+        '''append an array to the binary and describe it, returns the accessor index'''
+        data = np.ascontiguousarray(array).tobytes()
+        self.bin.write(data)
+        accessor = self.describe(len(data), component, len(array), kind, target)
+        if bounds:
+            columns = array.reshape(len(array), -1)
+            accessor["min"] = columns.min(axis=0).tolist()
+            accessor["max"] = columns.max(axis=0).tolist()
+        return len(self.gltf["accessors"]) - 1
+
+    def describe(self, length, component, count, kind, target = None):
+        '''add the view and accessor of the data just written to the binary, returns the accessor'''
+        view = {"buffer": 0, "byteOffset": self.offset, "byteLength": length}
+        if target:
+            view["target"] = target
+        padding = -length % 4 # keep every view aligned to four bytes
+        self.bin.write(b'\x00' * padding)
+        self.offset += length + padding
+
+        accessor = {"bufferView": len(self.gltf["bufferViews"]), "componentType": component,
+                    "count": count, "type": kind}
+        self.gltf["bufferViews"].append(view)
+        self.gltf["accessors"].append(accessor)
+        return accessor
+
+    def add_frame(self, frame, animation):
+        '''write the base mesh at the first frame, every frame becomes a morph target'''
+        positions = to_y_up(frame.vertices)
+        if frame.first_frame:
+            self.base = positions
+            uvs = frame.uvs.copy()
+            uvs[:, 1] = 1.0 - uvs[:, 1] # gltf uvs start at the top
+            attributes = self.primitive["attributes"]
+            attributes["POSITION"] = self.add_accessor(positions, 5126, "VEC3", 34962, True)
+            attributes["NORMAL"] = self.add_accessor(to_y_up(frame.normals), 5126, "VEC3", 34962)
+            attributes["TEXCOORD_0"] = self.add_accessor(uvs, 5126, "VEC2", 34962)
+            self.primitive["indices"] = self.add_accessor(frame.faces.ravel(), 5123, "SCALAR", 34963)
+        if animation:
+            delta = positions - self.base
+            self.primitive["targets"].append(
+                {"POSITION": self.add_accessor(delta, 5126, "VEC3", 34962, True)})
+            self.frame_ids.append(frame.frame_id)
+
+    def finish(self, animation, materials):
+        '''write the morph animation and the json'''
+        gltf = self.gltf
+        mesh = {"primitives": [self.primitive], "name": gltf["nodes"][0]["name"],
+                "extras": {"textures": [m.texture_name for m in materials]}}
+        if not self.primitive["targets"]:
+            del self.primitive["targets"]
+        else:
+            # one weight per target, only the current frame is fully on
+            count = len(self.frame_ids)
+            mesh["weights"] = [0.0] * count
+            times = np.array(self.frame_ids, dtype=np.float32) * animation.anim_time / animation.frames
+            times = self.add_accessor(times, 5126, "SCALAR", bounds=True)
+
+            # the weights of every keyframe are written one row at a time
+            weights = np.zeros(count, dtype=np.float32)
+            for i in range(count):
+                weights[i] = 1.0
+                self.bin.write(weights.tobytes())
+                weights[i] = 0.0
+            self.describe(count * count * 4, 5126, count * count, "SCALAR")
+            gltf["animations"] = [{
+                "samplers": [{"input": times,
+                              "output": len(gltf["accessors"]) - 1,
+                              "interpolation": "LINEAR"}],
+                "channels": [{"sampler": 0, "target": {"node": 0, "path": "weights"}}],
+                }]
+        gltf["meshes"] = [mesh]
+        self.bin.close()
+        gltf["buffers"].append({"uri": quote(os.path.basename(self.out_path) + '.bin'),
+                                "byteLength": self.offset})
+        with open(self.out_path + '.gltf', 'w') as out:
+            json.dump(gltf, out, indent=1)
+
+# pc2 point cache with the vertex positions of every frame, written as the frames come in.
+# The frames go to a temporary file that only replaces the cache when it is finished,
+# so a cache that is being played is never seen half written
+class PC2Writer:
+    HEADER = struct.Struct('<12s2i2fi')
+
+    def __init__(self, out_path, start = 0.0, sampling = 1.0):
+        self.path = out_path + '.pc2'
+        self.temp_path = self.path + '.tmp'
+        self.file = open(self.temp_path, 'wb')
+        self.start, self.sampling = start, sampling
+        self.num_points = 0
+        self.num_samples = 0
+        self.write_header()
+
+    def write_header(self):
+        '''the header, written again at the end with the number of samples'''
+        self.file.write(self.HEADER.pack(b'POINTCACHE2\x00', 1, self.num_points,
+                                         self.start, self.sampling, self.num_samples))
+
+    def add_frame(self, frame, animation = None):
+        '''append the vertex positions of a frame'''
+        if not self.num_samples:
+            self.num_points = frame.num_vertices
+        elif frame.num_vertices != self.num_points:
+            raise ValueError("Frame %d has %d vertices instead of %d" % (
+                frame.frame_id, frame.num_vertices, self.num_points))
+        self.file.write(np.ascontiguousarray(frame.vertices, dtype='<f4').tobytes())
+        self.num_samples += 1
+
+    def finish(self, animation = None, materials = None):
+        '''fill in the counts and replace the cache'''
+        self.file.seek(0)
+        self.write_header()
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        os.replace(self.temp_path, self.path)
+
+    def discard(self):
+        '''remove an unfinished cache'''
+        self.file.close()
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+
+WRITERS = {
+    "npz": NPZWriter,
+    "obj": OBJWriter,
+    "gltf": GLTFWriter,
+    "pc2": PC2Writer,
+    }
+
+def convert_file(file_path, out_path, file_format):
+    '''convert a single brg file to out_path, without extension,
+    only keeping one frame in memory at a time'''
+    folder = os.path.dirname(out_path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    writer = WRITERS[file_format](out_path)
+    reader = BRGReader(file_path)
+    animation, materials = None, []
+    try:
+        for section in reader.scan_sections():
+            if section.head == "ASET":
+                animation = reader.read_section(section)
+            elif section.head == "MESI":
+                writer.add_frame(reader.read_section(section), animation)
+            elif section.head == "MTRL":
+                materials.append(reader.read_section(section))
+        writer.finish(animation, materials)
+    finally:
+        reader.close()
+    return file_path
+
+def find_files(paths):
+    '''expand folders to the brg files they contain'''
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, names in os.walk(path):
+                files.extend(os.path.join(root, n) for n in sorted(names)
+                             if n.lower().endswith('.brg'))
+        else:
+            files.append(path)
+    return files
+
+def output_paths(file_paths, out_dir):
+    '''the output of every file without extension. The folders below the folder
+    all files are in are made again in out_dir, so files with the same name don't
+    overwrite each other. Raises ValueError when two files still get the same output'''
+    folders = [os.path.dirname(os.path.abspath(path)).split(os.sep) for path in file_paths]
+    common = os.sep.join(os.path.commonprefix(folders)) or os.sep
+    outputs, seen = [], {}
+    for path in file_paths:
+        name = os.path.splitext(os.path.relpath(os.path.abspath(path), common))[0]
+        out_path = os.path.join(out_dir, name)
+        key = os.path.normcase(os.path.abspath(out_path))
+        if key in seen:
+            raise ValueError("%s and %s would both be written to %s" % (seen[key], path, out_path))
+        seen[key] = path
+        outputs.append(out_path)
+    return outputs
+
+def convert_files(file_paths, out_dir, file_format, workers = 1):
+    '''convert files in parallel, yields the file path and the error if it failed'''
+    out_paths = output_paths(file_paths, out_dir)
+    with ProcessPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = [pool.submit(convert_file, path, out_path, file_format)
+                   for path, out_path in zip(file_paths, out_paths)]
+        for path, future in zip(file_paths, futures):
+            try:
+                future.result()
+                yield path, None
+            except Exception as e:
+                yield path, e
@@ -0,0 +1,118 @@
+import struct
+import numpy as np
+
+'''Decoding of Age of Mythology .ddt textures to rgba arrays, without external tools'''
+
+# texture formats in the ddt header
+BGRA = 1
+DXT1 = 4
+GREY = 7
+DXT3 = 8
+DXT5 = 9
+CUBEMAP = 8 # usage flag for cube maps, six faces per mip level
+
+class DDTError(Exception):
+    pass
+
+def unpack_565(colors):
+    '''16 bit colors to float rgb'''
+    r = (colors >> 11) & 31
+    g = (colors >> 5) & 63
+    b = colors & 31
+    return np.stack((r / 31.0, g / 63.0, b / 31.0), axis=-1).astype(np.float32)
+
+def decode_color(blocks, dxt1):
+    '''colors of (n, 8) byte blocks, returns (n, 16, 4) rgba'''
+    num = len(blocks)
+    colors = np.ascontiguousarray(blocks[:, :4]).view('<u2')
+    c0, c1 = colors[:, 0], colors[:, 1]
+    rgb0, rgb1 = unpack_565(c0), unpack_565(c1)
+
+    # dxt1 blocks with c0 <= c1 have three colors and transparent black
+    four = (c0 > c1) if dxt1 else np.ones(num, dtype=bool)
+    palette = np.ones((num, 4, 4), dtype=np.float32)
+    palette[:, 0, :3] = rgb0
+    palette[:, 1, :3] = rgb1
+    palette[:, 2, :3] = np.where(four[:, None], (2 * rgb0 + rgb1) / 3, (rgb0 + rgb1) / 2)
+    palette[:, 3, :3] = np.where(four[:, None], (rgb0 + 2 * rgb1) / 3, 0.0)
+    palette[:, 3, 3] = np.where(four, 1.0, 0.0)
+
+    bits = np.ascontiguousarray(blocks[:, 4:8]).view('<u4')
+    indices = (bits >> (2 * np.arange(16, dtype=np.uint32))) & 3
+    return palette[np.arange(num)[:, None], indices]
+
+def decode_explicit_alpha(blocks):
+    '''dxt3 alpha, 4 bits per pixel'''
+    alpha = blocks[:, :8]
+    nibbles = np.stack((alpha & 15, alpha >> 4), axis=-1).reshape(len(blocks), 16)
+    return nibbles / np.float32(15.0)
+
+def decode_interpolated_alpha(blocks):
+    '''dxt5 alpha, two end points and 3 bit indices'''
+    num = len(blocks)
+    a0 = blocks[:, 0].astype(np.float32) / 255.0
+    a1 = blocks[:, 1].astype(np.float32) / 255.0
+    eight = (a0 > a1)[:, None]
+
+    steps = np.arange(1, 7, dtype=np.float32)
+    palette = np.zeros((num, 8), dtype=np.float32)
+    palette[:, 0], palette[:, 1] = a0, a1
+    palette[:, 2:8] = np.where(eight,
+        ((7 - steps) * a0[:, None] + steps * a1[:, None]) / 7, 0.0)
+    five = ((5 - steps[:4]) * a0[:, None] + steps[:4] * a1[:, None]) / 5
+    palette[:, 2:6] = np.where(eight, palette[:, 2:6], five)
+    palette[:, 7] = np.where(eight[:, 0], palette[:, 7], 1.0)
+
+    padded = np.zeros((num, 8), dtype=np.uint8)
+    padded[:, :6] = blocks[:, 2:8]
+    bits = padded.view('<u8')
+    indices = (bits >> (3 * np.arange(16, dtype=np.uint64))) & 7
+    return palette[np.arange(num)[:, None], indices.astype(np.intp)]
+
+def decode_blocks(data, width, height, ddt_format):
+    '''decompress dxt blocks to a (height, width, 4) float array'''
+    bw, bh = (width + 3) // 4, (height + 3) // 4
+    size = 8 if ddt_format == DXT1 else 16
+    blocks = np.frombuffer(data, dtype=np.uint8, count=bw * bh * size).reshape(-1, size)
+
+    if ddt_format == DXT1:
+        pixels = decode_color(blocks, True)
+    else:
+        pixels = decode_color(blocks[:, 8:], False)
+        if ddt_format == DXT3:
+            pixels[..., 3] = decode_explicit_alpha(blocks)
+        else:
+            pixels[..., 3] = decode_interpolated_alpha(blocks)
+
+    # blocks of 4x4 pixels to rows of pixels
+    pixels = pixels.reshape(bh, bw, 4, 4, 4).transpose(0, 2, 1, 3, 4)
+    return pixels.reshape(bh * 4, bw * 4, 4)[:height, :width]
+
+def decode_ddt(data):
+    '''decode the first mip level of ddt data, returns a (height, width, 4) float rgba array, top row first'''
+    if len(data) < 16 or data[:4] != b'RTS3':
+        raise DDTError("Not a ddt texture")
+    usage, alpha, ddt_format, levels, width, height = struct.unpack_from('<4B2i', data, 4)
+    faces = 6 if usage & CUBEMAP else 1
+    if levels * faces < 1:
+        raise DDTError("Ddt texture without images")
+    offset, length = struct.unpack_from('<2I', data, 16)
+    image = memoryview(data)[offset:offset + length]
+
+    if ddt_format in (DXT1, DXT3, DXT5):
+        return decode_blocks(image, width, height, ddt_format)
+    elif ddt_format == BGRA:
+        pixels = np.frombuffer(image, dtype=np.uint8, count=width * height * 4)
+        pixels = pixels.reshape(height, width, 4)[..., (2, 1, 0, 3)]
+        return pixels / np.float32(255.0)
+    elif ddt_format == GREY:
+        grey = np.frombuffer(image, dtype=np.uint8, count=width * height).reshape(height, width)
+        pixels = np.ones((height, width, 4), dtype=np.float32)
+        pixels[..., :3] = grey[..., None] / np.float32(255.0)
+        return pixels
+    raise DDTError("Unsupported ddt format %d" % ddt_format)
+
+def read_ddt(file_path):
+    '''decode a ddt file'''
+    with open(file_path, 'rb') as ddt:
+        return decode_ddt(ddt.read())
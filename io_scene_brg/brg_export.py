@@ -1,83 +1,346 @@
 import bpy
 import os
+import time
+import numpy as np
 from mathutils import *
 import bmesh
 import math
 import struct
 from enum import Enum
 from .brg_util import *
+from .brg_format import (FileHeader, AnimationHeader, Attachpoints, MeshFrame, Material,
+                         BRGWriter, compose_matrices)
 
 class BRGExporter:
     def __init__(self, context, settings, addon_prefs):
         self.context = context
         self.addon_prefs = addon_prefs
         self.settings = settings
-
-        # open the file
-        self.file = File(self.settings.filepath, 'wb')
-        print("\n\n--<{ Exporting AoM model \"" + self.file.nice_name + '" }>--')
+        self.model = None
 
         active = bpy.context.scene.objects.active
 
         if not active or active.type != 'MESH' or active.select == False:
             settings.report({'ERROR'}, "No model selected")
-            return None
+            return
 
         self.model = active
         self.mesh = self.model.data
 
+        # the file is assembled in memory and only written when finished
+        self.file = BufferedFile(self.settings.filepath)
+        self.writer = BRGWriter(self.file)
+        stats.file = self.settings.filepath
+
 
     def finish_export(self):
-        '''close file reading and round up scene'''
-        self.file.close()
+        '''write the file and round up scene'''
+        with stats.stage("write"):
+            self.file.close()
 
 
-    def get_section_heads(self):
-        '''collect a list of sections for exporting'''
-        heads = []
-        heads.append("HEAD")
+    def cancel_export(self):
+        '''stop without touching the file'''
+        self.file.discard()
 
-        if self.mesh.shape_keys:
-            heads.append("ANIM")
-            for s in self.mesh.shape_keys:
-                heads.append("MESH")
-        else:
-            heads.append("MESH")
 
-        for m in self.mesh.materials:
-            heads.append("MATR")
-        return heads
+    def estimate_size(self):
+        '''size of the file in bytes, so the buffer is allocated only once'''
+        num_vertices, num_faces = self.num_vertices, self.num_faces
+        frame_size = 4 + 80 + num_vertices * 12 + 40
+        if self.colors is not None:
+            frame_size += num_vertices * 4
+        if self.armature:
+            frame_size += 6 + len(self.armature.pose.bones) * 36 + len(self.attachpoint_duplicates) * 8
+            frame_size += len(self.attachpoint_points)
+        first_frame = num_vertices * 6 + num_faces * 8
+        materials = sum(4 + 96 + len(m.texture_name) + len(m.sfx_name or "") for m in self.materials)
+        return 4 + 24 + 4 + 28 + frame_size * self.num_frames + first_frame + materials
+
+
+    def prepare_mesh(self):
+        '''gather the topology of the mesh in arrays, vertices are split where their uvs differ'''
+        mesh = self.mesh
+        num_loops, num_polygons = len(mesh.loops), len(mesh.polygons)
+
+        loop_vertices = np.empty(num_loops, dtype=np.int32)
+        mesh.loops.foreach_get("vertex_index", loop_vertices)
+        loop_start = np.empty(num_polygons, dtype=np.int32)
+        loop_total = np.empty(num_polygons, dtype=np.int32)
+        polygon_materials = np.empty(num_polygons, dtype=np.int32)
+        mesh.polygons.foreach_get("loop_start", loop_start)
+        mesh.polygons.foreach_get("loop_total", loop_total)
+        mesh.polygons.foreach_get("material_index", polygon_materials)
+
+        # fan triangulation of every polygon, in loop indices
+        tris_per_polygon = loop_total - 2
+        polygon_of_tri = np.repeat(np.arange(num_polygons), tris_per_polygon)
+        first_tri = np.cumsum(tris_per_polygon) - tris_per_polygon
+        corner = np.arange(len(polygon_of_tri)) - first_tri[polygon_of_tri]
+        start = loop_start[polygon_of_tri]
+        tri_loops = np.stack((start, start + corner + 1, start + corner + 2), axis=1)
+
+        # per loop attributes, a brg vertex has a single uv and color
+        attributes = [loop_vertices[:, np.newaxis].astype(np.float64)]
+        self.uvs = np.zeros((num_loops, 2), dtype=np.float32)
+        if mesh.uv_layers.active:
+            mesh.uv_layers.active.data.foreach_get("uv", self.uvs.ravel())
+        attributes.append(self.uvs)
+        self.colors = None
+        if mesh.vertex_colors.active:
+            self.colors = np.ones((num_loops, 4), dtype=np.float32)
+            colors = np.empty((num_loops, 3), dtype=np.float32)
+            mesh.vertex_colors.active.data.foreach_get("color", colors.ravel())
+            self.colors[:, :3] = colors
+            attributes.append(colors)
+
+        # unique combinations of vertex and attributes, in order of appearance
+        keys = np.ascontiguousarray(np.hstack(attributes))
+        keys = keys.view(np.dtype((np.void, keys.dtype.itemsize * keys.shape[1]))).ravel()
+        unique, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        order = np.argsort(first)
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order))
+        loop_to_vertex = rank[inverse.ravel()]
+        self.split_loops = first[order] # a loop of every brg vertex
+        self.vertex_map = loop_vertices[self.split_loops] # blender vertex of every brg vertex
+
+        self.faces = loop_to_vertex[tri_loops]
+        self.tri_vertices = loop_vertices[tri_loops] # for the normals
+        self.num_vertices, self.num_faces = len(self.vertex_map), len(self.faces)
+        if self.num_vertices > 0xFFFF or self.num_faces > 0xFFFF:
+            self.settings.report({'ERROR'}, "Too many vertices or faces for a brg file")
+            return False
+
+        # material ids of the faces and of the vertices
+        self.prepare_materials()
+        self.face_materials = self.matids[np.clip(polygon_materials[polygon_of_tri],
+                                                  0, len(self.matids) - 1)]
+        self.vertex_materials = np.zeros(self.num_vertices, dtype=np.uint16)
+        self.vertex_materials[self.faces.ravel()] = np.repeat(self.face_materials, 3)
+        return True
+
+
+    def prepare_materials(self):
+        '''material records of the material slots, keeping the settings of imported ones'''
+        self.materials = []
+        for index, mat in enumerate(self.mesh.materials):
+            matid = mat.get("brg_matid", index) if mat else index
+            props = mat.get("brg_flags", MatrFlags.MATNONE1.value | MatrFlags.MATTEXTURE.value) if mat else 0
+            material = Material(matid, Flag(props))
+            material.texture_name = self.texture_name(mat)
+            material.sfx_name = mat.get("brg_sfx") if mat else None
+            self.materials.append(material)
+
+        # ids have to be unique within the file
+        matids = [m.matid for m in self.materials]
+        if len(set(matids)) != len(matids):
+            for index, material in enumerate(self.materials):
+                material.matid = index
+        self.matids = np.array([m.matid for m in self.materials] or [0], dtype=np.uint16)
+
+
+    def texture_name(self, mat):
+        '''the game texture of a material, the image name without extension'''
+        if not mat:
+            return ""
+        if mat.get("brg_texture"):
+            return mat["brg_texture"]
+        if mat.use_nodes:
+            for node in mat.node_tree.nodes:
+                if node.type == 'TEX_IMAGE' and node.image:
+                    return os.path.splitext(node.image.name)[0]
+        return mat.name
+
 
+    def prepare_animation(self):
+        '''every shape key is a frame, timed by the eval time of the shape keys'''
+        scene = bpy.context.scene
+        shape_keys = self.mesh.shape_keys
+        self.key_blocks = list(shape_keys.key_blocks) if shape_keys else []
 
-    def write_section_head(self, head):
-        '''write a four letter header'''
-        self.file.write(head)
+        fps = scene.render.fps / scene.render.fps_base
+        self.anim_time = (scene.frame_end - scene.frame_start + 1) / fps
+        action = shape_keys and shape_keys.animation_data and shape_keys.animation_data.action
+        fcurve = action and action.fcurves.find("eval_time")
+        if fcurve and len(fcurve.keyframe_points):
+            self.anim_time = fcurve.keyframe_points[-1].co[0] / fps
 
+        # repeated frames share a shape key, then every keyframe is a frame
+        # and its value, ten per shape key, tells which one.
+        # an animation holding a single frame has only one shape key
+        if fcurve and len(fcurve.keyframe_points) > len(self.key_blocks) > 0:
+            values = np.array([point.co[1] for point in fcurve.keyframe_points])
+            indices = np.clip(np.rint(values / 10).astype(int) - 1, 0, len(self.key_blocks) - 1)
+            self.key_blocks = [self.key_blocks[i] for i in indices]
+        self.animated = len(self.key_blocks) > 1
+        self.num_frames = len(self.key_blocks) if self.animated else 1
+        # frames are keyed at the end of their duration
+        self.frame_times = (np.arange(self.num_frames) + 1) * self.anim_time * fps / self.num_frames
 
-    def write_file_header(self):
-        '''read the fileheader containing basic information'''
-        file, model, mesh = self.file, self.model, self.mesh
-        file.empty(4)
 
-        num_materials = len(self.mesh.materials)
-        file.write_uint(num_materials)
-        print("Number of materials:", num_materials)
+    def prepare_attachpoints(self):
+        '''the attachpoint armature parented to the model, if there is one'''
+        self.armature = None
+        for child in self.model.children:
+            if child.type == 'ARMATURE' and len(child.pose.bones):
+                self.armature = child
+                break
+        if not self.armature:
+            return
 
+        bones = self.armature.pose.bones
+        count = len(bones)
+        self.attachpoint_channels = (
+            np.array([b.location for b in bones], dtype=np.float32),
+            np.array([b.matrix_basis.to_quaternion() for b in bones], dtype=np.float32),
+            np.array([b.scale for b in bones], dtype=np.float32))
 
-        file.empty(4)
-        num_shape_keys = 1
-        if self.mesh.shape_keys:
-            num_shape_keys = len(self.mesh.shape_keys)
-        file.write_uint(num_shape_keys)
-        print("Number of shape keys:", num_shape_keys)
-        file.empty(8)
+        # animated channels are sampled frame by frame
+        self.attachpoint_curves = []
+        animation = self.armature.animation_data
+        action = animation and animation.action
+        if action and self.animated:
+            for i, bone in enumerate(bones):
+                for path, values in zip(("location", "rotation_quaternion", "scale"),
+                                        self.attachpoint_channels):
+                    data_path = 'pose.bones["%s"].%s' % (bone.name, path)
+                    for index in range(values.shape[-1]):
+                        fcurve = action.fcurves.find(data_path, index)
+                        if fcurve:
+                            self.attachpoint_curves.append((values, i, index, fcurve))
 
+        # index data of imported attachpoints
+        data = self.armature.data
+        self.attachpoint_duplicates = list(data.get("brg_duplicates", []))
+        self.attachpoint_points = list(data.get("brg_points", []))
+        self.attachpoint_vectors = None
+        if len(data.get("brg_unknown_vectors", [])) == count * 6:
+            self.attachpoint_vectors = np.array(data["brg_unknown_vectors"],
+                                                dtype=np.float32).reshape(count * 2, 3)
 
-    def write_animation_header(self):
-        pass
 
-    def write_mesh(frame_id):
-        pass
+    def sections(self):
+        '''yield the head and record of every section, frames are only made when they are needed'''
+        header = FileHeader(len(self.materials), self.num_frames)
+        yield "BANG", header
 
-    def write_materials():
-        pass
+        if self.animated:
+            frames, anim_time = self.num_frames, self.anim_time
+            # the game plays the frames evenly over the animation time
+            animation = AnimationHeader(frames, anim_time, anim_time / frames, frames / anim_time)
+            yield "ASET", animation
+
+        first = True
+        for frame_id in range(self.num_frames):
+            if self.animated and self.key_blocks[frame_id].mute:
+                continue # muted shape keys are left out
+            with stats.stage("frames"):
+                frame = self.make_frame(frame_id, first)
+            yield "MESI", frame
+            first = False
+
+        for material in self.materials:
+            yield "MTRL", material
+
+
+    def write_sections(self):
+        '''encode and write every section before making the next one,
+        the frame count is filled in at the end'''
+        writer = self.writer
+        self.file.reserve(min(self.estimate_size(), self.file.flush_size))
+        frames = 0
+        for head, record in self.sections():
+            offset = self.file.tell()
+            start = time.perf_counter()
+            with stats.stage("encode"):
+                writer.write_section(head, record)
+            if stats.enabled:
+                self.record_section(head, record, offset, time.perf_counter() - start)
+            if head == "MESI":
+                frames += 1
+        writer.patch_frames(frames)
+        return frames
+
+
+    def record_section(self, head, record, offset, seconds):
+        '''add the time, size and element counts of a written section to the stats'''
+        counts = {}
+        if head == "MESI":
+            counts = {"vertices": record.num_vertices,
+                      "faces": record.num_faces if record.first_frame else 0}
+            stats.count("vertices", record.num_vertices)
+            stats.count("frames")
+        elif head == "MTRL":
+            stats.count("materials")
+        stats.section(head, offset, self.file.tell() - offset, seconds, counts)
+
+
+    def frame_coordinates(self, frame_id):
+        '''vertex positions of a frame in one block'''
+        coords = np.empty((len(self.mesh.vertices), 3), dtype=np.float32)
+        if self.animated:
+            self.key_blocks[frame_id].data.foreach_get("co", coords.ravel())
+        else:
+            self.mesh.vertices.foreach_get("co", coords.ravel())
+        return coords
+
+
+    def vertex_normals(self, coords):
+        '''area weighted normals of the blender vertices'''
+        corners = coords[self.tri_vertices]
+        face_normals = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+        indices = self.tri_vertices.ravel()
+        normals = np.empty_like(coords)
+        for axis in range(3):
+            normals[:, axis] = np.bincount(indices, np.repeat(face_normals[:, axis], 3),
+                                           minlength=len(coords))
+        lengths = np.linalg.norm(normals, axis=1)
+        lengths[lengths == 0] = 1.0
+        return normals / lengths[:, np.newaxis]
+
+
+    def attachpoint_matrices(self, frame_id):
+        '''matrices of the attachpoint bones at a single frame'''
+        for values, bone, index, fcurve in self.attachpoint_curves:
+            values[bone, index] = fcurve.evaluate(self.frame_times[frame_id])
+        return compose_matrices(*self.attachpoint_channels)
+
+
+    def make_frame(self, frame_id, first):
+        '''build the record of a single frame from the mesh arrays'''
+        coords = self.frame_coordinates(frame_id)
+        frame = MeshFrame()
+        frame.version, frame.format = 22, 4
+        frame.num_vertices, frame.num_faces = self.num_vertices, self.num_faces
+        frame.vertices = coords[self.vertex_map]
+        frame.normals = self.vertex_normals(coords)[self.vertex_map]
+        frame.calc_bounds()
+        frame.unknown_vector = np.zeros(3, dtype=np.float32)
+        frame.ground_pos = np.array(self.model.delta_location, dtype=np.float32)
+        frame.anim_time_mult = 1.0
+
+        props = MeshFlags.TEXTURE.value | MeshFlags.MATERIALS.value
+        if not first:
+            props |= MeshFlags.NOTFIRST.value
+        else:
+            frame.uvs = self.uvs[self.split_loops]
+            frame.faces = self.faces
+            frame.face_materials = self.face_materials
+            frame.vertex_materials = self.vertex_materials
+            frame.num_materials_used = len(np.unique(self.face_materials))
+        if self.colors is not None:
+            props |= MeshFlags.VERTCOLOR.value
+            frame.colors = self.colors[self.split_loops]
+        if self.armature:
+            props |= MeshFlags.ATTACHPOINTS.value
+            points = Attachpoints()
+            points.num_matrix = len(self.armature.pose.bones)
+            points.matrices = self.attachpoint_matrices(frame_id)
+            points.unknown_vectors = self.attachpoint_vectors
+            points.duplicates = self.attachpoint_duplicates
+            points.points = self.attachpoint_points
+            points.num_index = len(points.duplicates)
+            frame.attachpoints = points
+        frame.props = Flag(props)
+        return frame
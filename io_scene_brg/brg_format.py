@@ -0,0 +1,717 @@
+import time
+import numpy as np
+from .brg_util import MappedFile, Flag, MeshFlags, MatrFlags, UINT, FLOAT, stats
+
+'''Blender independent parsing and writing of brg files as plain records with arrays'''
+
+# values found in the unknown data of the game files, written as they are
+HEADER_ID = 0x77346403
+MESH_ID = 0x0B6DB1C8
+
+# starting worker processes and moving the arrays costs more than decoding small files,
+# the pool is only used from this many vertices over all frames
+POOL_MIN_VERTICES = 2000000
+
+# Records for each of the sections in a brg file.
+class FileHeader:
+    '''BANG section, basic information about the file'''
+    def __init__(self, num_materials, num_shape_keys):
+        self.num_materials = num_materials
+        self.num_shape_keys = num_shape_keys
+
+class AnimationHeader:
+    '''ASET section, frame settings of an animated file'''
+    def __init__(self, frames, anim_time, spf, fps):
+        self.frames = frames
+        self.anim_time = anim_time
+        self.spf = spf
+        self.fps = fps
+
+class Attachpoints:
+    '''attachpoint matrices of a single frame'''
+    def __init__(self):
+        self.num_matrix = 0
+        self.num_index = 0
+        self.matrices = None # (num_matrix, 4, 4) float32
+        self.unknown_vectors = None
+        self.duplicates = []
+        self.points = []
+
+class MeshFrame:
+    '''MESI section, vertex data of a single frame'''
+    def __init__(self):
+        self.version = 0
+        self.format = 0
+        self.num_vertices = 0
+        self.num_faces = 0
+        self.state = 0
+        self.props = Flag(0)
+
+        # bounding box and position
+        self.bb_center = None
+        self.bb_height = 0.0
+        self.unknown_vector = None
+        self.ground_pos = None
+        self.bb_corner_positive = None
+        self.bb_corner_negative = None
+
+        # per frame arrays
+        self.vertices = None # (num_vertices, 3) float32
+        self.normals = None # (num_vertices, 3) float32
+        self.colors = None # (num_vertices, 4) float32, optional
+
+        # only present in the first frame
+        self.uvs = None # (num_vertices, 2) float32
+        self.face_materials = None # (num_faces,) uint16
+        self.faces = None # (num_faces, 3) uint16
+        self.vertex_materials = None # (num_vertices,) uint16, optional
+
+        # optional extra data, meaning unsure
+        self.check_space = 0
+        self.anim_time_mult = 0.0
+        self.num_materials_used = 0
+        self.anim_time_adjust = []
+
+        self.attachpoints = None
+        self.frame_id = 0 # position of the frame in the file
+
+    def calc_bounds(self):
+        '''set the bounding box from the vertices'''
+        low, high = self.vertices.min(axis=0), self.vertices.max(axis=0)
+        self.bb_center = (low + high) / 2
+        self.bb_corner_negative = (high - low) / 2
+        self.bb_corner_positive = -self.bb_corner_negative
+        self.bb_height = float(self.bb_corner_negative.max())
+
+    @property
+    def first_frame(self):
+        return not self.props.has(MeshFlags.NOTFIRST)
+
+    @property
+    def has_colors(self):
+        '''vertex colors, can be animated or not'''
+        props = self.props
+        return (((props.has(MeshFlags.TRANSPCOLOR) or
+                  props.has(MeshFlags.CHANGINGCOL)) and
+                  self.first_frame) or
+                  props.has(MeshFlags.VERTCOLOR))
+
+class Section:
+    '''location of a section in the file, found by scanning without decoding'''
+    def __init__(self, head, offset, frame = None):
+        self.head = head
+        self.offset = offset # start of the data, after the four letter header
+        self.size = 0
+        self.frame = frame # frame number of MESI sections
+        self.header = None # MESI header without arrays
+
+class Material:
+    '''MTRL section, material settings and texture name'''
+    def __init__(self, matid, props):
+        self.matid = matid
+        self.props = props
+        self.texture_name = ""
+        self.sfx_name = None
+
+# Reader turning the sections of a brg file into records.
+class BRGReader:
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.file = MappedFile(file_path)
+        self.sections = None
+        self.decode_stage = "decode" # stage the decoding time is added to
+
+    def close(self):
+        '''close the file object'''
+        self.file.close()
+
+    def read_section_head(self):
+        '''read a four letter header'''
+        return self.file.read(4)
+
+    def scan_sections(self):
+        '''index the offset of every section, only reading the values that define its size'''
+        if self.sections is not None:
+            return self.sections
+        file = self.file
+        start = file.tell()
+        file.seek(0)
+
+        self.sections = []
+        frame_id = 0
+        head = self.read_section_head()
+        while head:
+            section = Section(head, file.tell())
+            if head == "BANG": #Main file header
+                file.skip(24)
+            elif head == "ASET": #Animation definition
+                file.skip(28)
+            elif head == "MESI": #Mesh data
+                section.header = self.skip_mesh()
+                section.frame = frame_id
+                frame_id += 1
+            elif head == "MTRL": #Material settings
+                self.skip_materials()
+            else:
+                break
+            if file.tell() > file.size: # truncated section
+                break
+            section.size = file.tell() - section.offset
+            self.sections.append(section)
+            head = self.read_section_head()
+
+        file.seek(start)
+        return self.sections
+
+    def frame_sections(self):
+        '''the indexed MESI sections in frame order'''
+        return [s for s in self.scan_sections() if s.head == "MESI"]
+
+    def read_section(self, section):
+        '''seek to an indexed section and parse its record'''
+        self.file.seek(section.offset)
+        if section.head == "BANG":
+            return self.read_file_header()
+        elif section.head == "ASET":
+            return self.read_animation_header()
+        elif section.head == "MESI":
+            frame = self.read_mesh()
+            frame.frame_id = section.frame
+            return frame
+        elif section.head == "MTRL":
+            return self.read_materials()
+
+    def read_frame(self, frame_id):
+        '''decode a single frame on demand'''
+        return self.read_section(self.frame_sections()[frame_id])
+
+    def read_material_records(self):
+        '''records of all materials, without decoding the frames'''
+        return [self.read_section(s) for s in self.scan_sections() if s.head == "MTRL"]
+
+    def read_sections(self, use_frame = None, workers = 0):
+        '''yield the parsed record of every indexed section,
+        use_frame can tell which frame numbers should be decoded
+        and with more than one worker the frames of big files are decoded in a process pool'''
+        frames, pooled = None, workers < 2
+        for section in self.scan_sections():
+            if section.head == "MESI":
+                if use_frame and not use_frame(section.frame):
+                    continue
+                if not pooled: # start decoding all selected frames at the first one
+                    from .brg_parallel import decode_frames
+                    pooled = True
+                    selected = [s for s in self.frame_sections()
+                                if not use_frame or use_frame(s.frame)]
+                    num_vertices = sum(s.header.num_vertices for s in selected)
+                    if len(selected) > workers and num_vertices >= POOL_MIN_VERTICES:
+                        frames = decode_frames(self.file_path, selected, workers)
+            start = time.perf_counter()
+            if section.head == "MESI" and frames is not None:
+                record = next(frames)
+            else:
+                record = self.read_section(section)
+            if stats.enabled:
+                self.record_section(section, record, time.perf_counter() - start)
+            yield section.head, record
+
+    def record_section(self, section, record, seconds):
+        '''add the time, size and element counts of a decoded section to the stats'''
+        counts = {}
+        if section.head == "MESI":
+            counts = {"frame": record.frame_id, "vertices": record.num_vertices,
+                      "faces": record.num_faces if record.first_frame else 0,
+                      "attachpoints": record.attachpoints.num_matrix if record.attachpoints else 0}
+            stats.count("vertices", record.num_vertices)
+            stats.count("frames")
+        elif section.head == "MTRL":
+            stats.count("materials")
+        if self.decode_stage:
+            stats.add_stage(self.decode_stage, seconds)
+        stats.section(section.head, section.offset, section.size, seconds, counts, self.file_path)
+
+    def read_file_header(self):
+        '''read the fileheader containing basic information'''
+        file = self.file
+        file.skip(4)
+        num_materials = file.read_uint()
+        file.skip(4)
+        num_shape_keys = file.read_uint()
+        file.skip(8)
+        return FileHeader(num_materials, num_shape_keys)
+
+    def read_animation_header(self):
+        '''read animation info'''
+        file = self.file
+        frames = file.read_uint() # amount of frames in the file for animation
+        file.skip(4)
+        anim_time = file.read_float()
+        file.skip(4)
+        spf = file.read_float()
+        fps = file.read_float()
+        file.skip(4)
+        return AnimationHeader(frames, anim_time, spf, fps)
+
+    def read_vec3_full(self):
+        '''reads a float vector with y and z swapped to blender space'''
+        file = self.file
+        x = file.read_float()
+        y = file.read_float()
+        z = file.read_float()
+        return np.array((x,z,y), dtype=np.float32)
+
+    def read_mesh_header(self):
+        '''read the fixed size header of a single frame'''
+        file = self.file
+        frame = MeshFrame()
+
+        frame.version = file.read_short() #2
+        frame.format = file.read_short() #2
+
+        #vertex and face info
+        frame.num_vertices = file.read_short() #2
+        frame.num_faces = file.read_short() #2
+        frame.state = file.read_int() #4
+
+        # bounding box and position
+        frame.bb_center = self.read_vec3_full() #12
+        frame.bb_height = file.read_float() #4
+        frame.unknown_vector = self.read_vec3_full() #12
+        frame.ground_pos = -self.read_vec3_full() #12
+
+        # property flags, Very important!
+        frame.props = file.read_flag() #4
+
+        # bounding box corners
+        frame.bb_corner_positive = self.read_vec3_full() #12
+        frame.bb_corner_negative = self.read_vec3_full() #12
+        return frame
+
+    def read_mesh(self):
+        '''read a single frame'''
+        file = self.file
+        frame = self.read_mesh_header()
+        props = frame.props
+
+        # vertex positions and normals
+        frame.vertices = file.read_vec3_array(frame.num_vertices)
+        frame.normals = file.read_vec3_array(frame.num_vertices)
+
+        # this data only appears once at the first frame.
+        if frame.first_frame:
+            frame.uvs = file.read_vec2_array(frame.num_vertices)
+            # material index for faces.
+            # it's set to a very high value in default brg files
+            frame.face_materials = file.read_short_array(frame.num_faces)
+            frame.faces = file.read_face_array(frame.num_faces)
+            if props.has(MeshFlags.MATERIALS):
+                frame.vertex_materials = file.read_short_array(frame.num_vertices)
+
+        file.skip(24)
+        frame.check_space = file.read_uint() # Unkown but important flag for edge cases
+        len_space = 0
+        if not frame.check_space: # some optional read data, meaning not sure
+            frame.anim_time_mult = file.read_float()
+            len_space = file.read_uint()
+            frame.num_materials_used = file.read_uint()
+
+        # vertex colors, can be animated or not
+        if frame.has_colors:
+            frame.colors = file.read_color_array(frame.num_vertices)
+
+        if props.has(MeshFlags.ATTACHPOINTS):
+            frame.attachpoints = self.read_attachpoints()
+
+        #optional extra space in some edge cases, meaning unsure
+        if len_space > 0:
+            frame.anim_time_adjust = [file.read_float() for i in range(len_space)]
+        return frame
+
+    def skip_mesh(self):
+        '''move past a frame without decoding its arrays'''
+        file = self.file
+        frame = self.read_mesh_header()
+        num_vertices, num_faces = frame.num_vertices, frame.num_faces
+
+        file.skip(num_vertices * 12) # positions and normals
+        if frame.first_frame:
+            file.skip(num_vertices * 4 + num_faces * 8) # uvs, face materials and faces
+            if frame.props.has(MeshFlags.MATERIALS):
+                file.skip(num_vertices * 2)
+
+        file.skip(24)
+        len_space = 0
+        if not file.read_uint():
+            file.skip(4)
+            len_space = file.read_uint()
+            file.skip(4)
+
+        if frame.has_colors:
+            file.skip(num_vertices * 4)
+        if frame.props.has(MeshFlags.ATTACHPOINTS):
+            frame.attachpoints = self.skip_attachpoints()
+        file.skip(len_space * 4)
+        return frame
+
+    def skip_attachpoints(self):
+        '''move past the attachpoints of a frame, only keeping the counts'''
+        file = self.file
+        points = Attachpoints()
+        points.num_matrix = file.read_short()
+        points.num_index = file.read_short()
+        file.skip(2 + points.num_matrix * 36) # four vectors and two unknown vectors
+        for i in range(points.num_index):
+            points.duplicates.append(file.read_int())
+            file.skip(4)
+        file.skip(sum(points.duplicates))
+        return points
+
+    def read_attachpoints(self):
+        '''read the attachpoint matrices of a frame'''
+        file = self.file
+        points = Attachpoints()
+        points.num_matrix = file.read_short()
+        points.num_index = file.read_short()
+        file.skip(2)
+
+        # Read armature matrix data
+        num = points.num_matrix
+        xs = file.read_vec3_array(num)
+        ys = file.read_vec3_array(num)
+        zs = file.read_vec3_array(num)
+        positions = file.read_vec3_array(num)
+
+        # compile the matrices with the z, y and x axis as columns
+        matrices = np.zeros((num, 4, 4), dtype=np.float32)
+        matrices[:, :3, :3] = np.stack((zs, ys, xs), axis=2)
+        matrices[:, :3, 3] = positions
+        matrices[:, 3, 3] = 1.0
+        points.matrices = matrices
+
+        points.unknown_vectors = file.read_vec3_array(num * 2)
+
+        # Read attachpoint names. Not correct yet!
+        for i in range(points.num_index):
+            points.duplicates.append(file.read_int())
+            file.skip(4)
+        points.points = [file.read_byte() for i in range(sum(points.duplicates))]
+        return points
+
+    def read_materials(self):
+        '''read material data'''
+        file = self.file
+        material = Material(file.read_uint(), file.read_flag())
+
+        # texture settings
+        file.skip(4)
+        name_length = file.read_uint()
+        file.skip(48) # unknown data
+        material.texture_name = file.read(name_length)
+        file.skip(4)
+
+        # optional sfx data
+        if material.props.has(MatrFlags.SFX):
+            file.skip(2)
+            sfx_length = file.read_short()
+            material.sfx_name = file.read(sfx_length)
+        return material
+
+    def skip_materials(self):
+        '''move past material data'''
+        file = self.file
+        file.skip(4)
+        props = file.read_flag()
+        file.skip(4)
+        name_length = file.read_uint()
+        file.skip(48 + name_length + 4)
+        if props.has(MatrFlags.SFX):
+            file.skip(2)
+            file.skip(file.read_short())
+
+# Writer turning records back into the sections of a brg file.
+class BRGWriter:
+    def __init__(self, file):
+        self.file = file
+        self.anim_time = 0.0
+        self.header_offset = None # start of the headers, for filling in the frame count
+        self.animation_offset = None
+
+    def write_section_head(self, head):
+        '''write a four letter header'''
+        self.file.write(head)
+
+    def write_section(self, head, record):
+        '''write the header and the data of a record'''
+        self.write_section_head(head)
+        if head == "BANG":
+            self.write_file_header(record)
+        elif head == "ASET":
+            self.write_animation_header(record)
+        elif head == "MESI":
+            self.write_mesh(record)
+        elif head == "MTRL":
+            self.write_materials(record)
+
+    def write_file_header(self, header):
+        '''write the fileheader containing basic information'''
+        file = self.file
+        self.header_offset = file.tell()
+        file.write_empty(4)
+        file.write_uint(header.num_materials)
+        file.write_empty(4)
+        file.write_uint(header.num_shape_keys)
+        file.write_empty(4)
+        file.write_uint(HEADER_ID)
+
+    def write_animation_header(self, animation):
+        '''write animation info'''
+        file = self.file
+        self.anim_time = animation.anim_time
+        self.animation_offset = file.tell()
+        file.write_uint(animation.frames)
+        file.write_float(1.0 / animation.frames if animation.frames else 0.0)
+        file.write_float(animation.anim_time)
+        file.write_float(1.0 / animation.anim_time if animation.anim_time else 0.0)
+        file.write_float(animation.spf)
+        file.write_float(animation.fps)
+        file.write_empty(4)
+
+    def patch_frames(self, frames):
+        '''fill in the number of frames once all of them are written'''
+        file = self.file
+        file.patch(self.header_offset + 12, UINT, frames)
+        if self.animation_offset is not None and frames:
+            offset, anim_time = self.animation_offset, self.anim_time
+            file.patch(offset, UINT, frames)
+            file.patch(offset + 4, FLOAT, 1.0 / frames)
+            file.patch(offset + 16, FLOAT, anim_time / frames)
+            file.patch(offset + 20, FLOAT, frames / anim_time if anim_time else 0.0)
+
+    def write_vec3_full(self, vec):
+        '''write a float vector with y and z swapped back from blender space'''
+        x, y, z = (float(v) for v in vec)
+        file = self.file
+        file.write_float(x)
+        file.write_float(z)
+        file.write_float(y)
+
+    def write_mesh_header(self, frame):
+        '''write the fixed size header of a single frame'''
+        file = self.file
+        file.write_short(frame.version)
+        file.write_short(frame.format)
+        file.write_short(frame.num_vertices)
+        file.write_short(frame.num_faces)
+        file.write_int(frame.state)
+
+        self.write_vec3_full(frame.bb_center)
+        file.write_float(frame.bb_height)
+        self.write_vec3_full(frame.unknown_vector)
+        self.write_vec3_full(-np.asarray(frame.ground_pos))
+
+        file.write_flag(frame.props)
+        self.write_vec3_full(frame.bb_corner_positive)
+        self.write_vec3_full(frame.bb_corner_negative)
+
+    def write_mesh(self, frame):
+        '''write a single frame'''
+        file = self.file
+        self.write_mesh_header(frame)
+        file.write_vec3_array(frame.vertices)
+        file.write_vec3_array(frame.normals)
+
+        if frame.first_frame:
+            file.write_vec2_array(frame.uvs)
+            file.write_short_array(frame.face_materials)
+            file.write_face_array(frame.faces)
+            if frame.props.has(MeshFlags.MATERIALS):
+                file.write_short_array(frame.vertex_materials)
+
+        file.write_empty(12)
+        file.write_uint(1)
+        file.write_float(self.anim_time)
+        file.write_uint(MESH_ID)
+        file.write_uint(frame.check_space)
+        if not frame.check_space:
+            file.write_float(frame.anim_time_mult)
+            file.write_uint(len(frame.anim_time_adjust))
+            file.write_uint(frame.num_materials_used)
+
+        if frame.has_colors:
+            file.write_color_array(frame.colors)
+        if frame.props.has(MeshFlags.ATTACHPOINTS):
+            self.write_attachpoints(frame.attachpoints)
+        for adjust in frame.anim_time_adjust:
+            file.write_float(adjust)
+
+    def write_attachpoints(self, points):
+        '''write the attachpoint matrices of a frame'''
+        file = self.file
+        num = points.num_matrix
+        file.write_short(num)
+        file.write_short(len(points.duplicates))
+        file.write_short(1)
+
+        # the z, y and x axis are the columns of the matrices
+        matrices = np.asarray(points.matrices, dtype=np.float32).reshape(num, 4, 4)
+        for column in (2, 1, 0, 3):
+            file.write_vec3_array(matrices[:, :3, column])
+        if points.unknown_vectors is None:
+            file.write_vec3_array(np.zeros((num * 2, 3), dtype=np.float32))
+        else:
+            file.write_vec3_array(points.unknown_vectors)
+
+        for duplicate in points.duplicates:
+            file.write_int(duplicate)
+            file.write_empty(4)
+        file.write_block(bytes(bytearray(points.points)))
+
+    def write_materials(self, material):
+        '''write material data'''
+        file = self.file
+        file.write_uint(material.matid)
+        file.write_flag(material.props)
+
+        # texture settings
+        file.write_empty(4)
+        file.write_uint(len(material.texture_name))
+        for i in range(6):
+            file.write_float(1.0)
+        file.write_empty(24)
+        file.write(material.texture_name)
+        file.write_float(1.0)
+
+        # optional sfx data
+        if material.props.has(MatrFlags.SFX):
+            file.write_empty(2)
+            file.write_short(len(material.sfx_name or ""))
+            file.write(material.sfx_name or "")
+
+class FrameKeys:
+    '''the shapekey of every imported frame in order, a frame holding the positions of the
+    frame before shares its shapekey. Earlier shapekeys are never reused, the curve
+    selecting the shapekeys would pass the ones in between and blend them in'''
+    def __init__(self):
+        self.count = 0
+        self.last = None # positions of the last frame
+        self.reused = 0
+
+    def add(self, vertices):
+        '''returns the index of the shapekey of the next frame and if it is a new one'''
+        if self.last is not None and np.array_equal(vertices, self.last):
+            self.reused += 1
+            return self.count - 1, False
+        self.last = vertices
+        self.count += 1
+        return self.count - 1, True
+
+def select_frames(frames, frame_start = 1, frame_end = 0, frame_step = 1):
+    '''frame numbers within an import range, start and end count from 1, end 0 is the last frame'''
+    start = min(frame_start, frames) - 1
+    end = min(frame_end or frames, frames)
+    return list(range(start, max(end, start + 1), frame_step))
+
+def read_file_sections(file_path, frame_start = 1, frame_end = 0, frame_step = 1):
+    '''parse all sections of a file up front, returns the sections and the time it took.
+    Frames outside of the range are skipped, except the first one holding the faces'''
+    start = time.time()
+    reader = BRGReader(file_path)
+    reader.decode_stage = None # the caller times the whole parse
+    selected = None
+    def use_frame(frame_id):
+        return selected is None or frame_id == 0 or frame_id in selected
+
+    sections = []
+    try:
+        for head, section in reader.read_sections(use_frame):
+            if head == "ASET":
+                selected = set(select_frames(section.frames, frame_start, frame_end, frame_step))
+            sections.append((head, section))
+    finally:
+        reader.close()
+    return sections, time.time() - start
+
+def read_brg(file_path):
+    '''read all sections of a brg file, returns header, animation, frames and materials'''
+    reader = BRGReader(file_path)
+    header, animation, frames, materials = None, None, [], []
+    try:
+        for head, section in reader.read_sections():
+            if head == "BANG":
+                header = section
+            elif head == "ASET":
+                animation = section
+            elif head == "MESI":
+                frames.append(section)
+            elif head == "MTRL":
+                materials.append(section)
+    finally:
+        reader.close()
+    return header, animation, frames, materials
+
+def decompose_matrices(matrices):
+    '''split an array of 4x4 matrices in locations, quaternions (w,x,y,z) and scales'''
+    matrices = np.asarray(matrices, dtype=np.float64)
+    locations = matrices[..., :3, 3]
+    basis = matrices[..., :3, :3]
+
+    # scale is the length of the columns, negative for mirrored matrices
+    scales = np.linalg.norm(basis, axis=-2)
+    scales[np.linalg.det(basis) < 0] *= -1
+    scales[scales == 0] = 1e-8
+    rot = basis / scales[..., np.newaxis, :]
+
+    # convert the rotation to quaternions, using the most stable diagonal
+    m00, m11, m22 = rot[..., 0, 0], rot[..., 1, 1], rot[..., 2, 2]
+    trace = m00 + m11 + m22
+    quats = np.empty(matrices.shape[:-2] + (4,))
+    cases = [ # condition, pivot, indices of the other three components
+        (trace > 0, 1.0 + trace, 0),
+        ((m00 >= m11) & (m00 >= m22), 1.0 + m00 - m11 - m22, 1),
+        (m11 >= m22, 1.0 - m00 + m11 - m22, 2),
+        (True, 1.0 - m00 - m11 + m22, 3)]
+    done = np.zeros(trace.shape, dtype=bool)
+    for condition, pivot, case in cases:
+        mask = condition & ~done
+        done |= mask
+        s = np.sqrt(np.maximum(pivot[mask], 1e-12)) * 2
+        r = rot[mask]
+        w = (r[:, 2, 1] - r[:, 1, 2]) / s
+        x = (r[:, 0, 2] - r[:, 2, 0]) / s
+        y = (r[:, 1, 0] - r[:, 0, 1]) / s
+        z = (r[:, 0, 1] + r[:, 1, 0]) / s
+        u = (r[:, 0, 2] + r[:, 2, 0]) / s
+        v = (r[:, 1, 2] + r[:, 2, 1]) / s
+        if case == 0:
+            q = (s / 4, w, x, y)
+        elif case == 1:
+            q = (w, s / 4, z, u)
+        elif case == 2:
+            q = (x, z, s / 4, v)
+        else:
+            q = (y, u, v, s / 4)
+        quats[mask] = np.stack(q, axis=-1)
+
+    # keep consecutive frames in the same hemisphere for smooth interpolation
+    if quats.ndim == 3:
+        for i in range(1, len(quats)):
+            flip = np.sum(quats[i] * quats[i - 1], axis=-1) < 0
+            quats[i][flip] *= -1
+    return locations, quats, scales
+
+def compose_matrices(locations, quaternions, scales):
+    '''build 4x4 matrices from locations, quaternions (w,x,y,z) and scales'''
+    quats = np.asarray(quaternions, dtype=np.float64)
+    quats = quats / np.maximum(np.linalg.norm(quats, axis=-1), 1e-12)[..., np.newaxis]
+    w, x, y, z = np.moveaxis(quats, -1, 0)
+    rot = np.stack((
+        1 - 2 * (y * y + z * z), 2 * (x * y - w * z), 2 * (x * z + w * y),
+        2 * (x * y + w * z), 1 - 2 * (x * x + z * z), 2 * (y * z - w * x),
+        2 * (x * z - w * y), 2 * (y * z + w * x), 1 - 2 * (x * x + y * y)),
+        axis=-1).reshape(quats.shape[:-1] + (3, 3))
+
+    matrices = np.zeros(quats.shape[:-1] + (4, 4))
+    matrices[..., :3, :3] = rot * np.asarray(scales)[..., np.newaxis, :]
+    matrices[..., :3, 3] = locations
+    matrices[..., 3, 3] = 1.0
+    return matrices.astype(np.float32)
@@ -1,5 +1,11 @@
 import bpy
 import os
+import tempfile
+import time
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import numpy as np
 from mathutils import *
 import bmesh
 import math
@@ -7,17 +13,182 @@ import struct
 from enum import Enum
 from mathutils import *
 from .brg_util import *
+from .brg_format import BRGReader, FrameKeys, decompose_matrices, select_frames, read_file_sections
+from .brg_convert import PC2Writer
+
+def is_valid(block, collection):
+    '''if a cached datablock still exists in the blend file'''
+    try:
+        return block is not None and collection.get(block.name) == block
+    except ReferenceError: # removed by the user
+        return False
+
+# datablocks shared by all imports, equal materials and the bone shape are only made once
+class ImportCache:
+    def __init__(self):
+        self.images = {} # texture name to image, None if not found
+        self.materials = {} # signature to material
+        self.shape = None # custom shape for attachpoint bones
+        self.meshes = {} # import key to mesh
+        self.digests = {} # (path, size, mtime) to hash of the file content
+
+    def start_batch(self):
+        '''forget textures that weren't found, they might have been added since the last import'''
+        self.images = dict((name, img) for name, img in self.images.items()
+                           if is_valid(img, bpy.data.images))
+        loaded_images.refresh()
+
+    def get_material(self, signature):
+        '''the material made for a signature, also found in a saved blend file'''
+        material = self.materials.get(signature)
+        if is_valid(material, bpy.data.materials):
+            return material
+        for material in bpy.data.materials:
+            if material.get("brg_signature") == signature:
+                self.materials[signature] = material
+                return material
+        return None
+
+    def add_material(self, signature, material):
+        '''remember a new material by its signature'''
+        material["brg_signature"] = signature
+        self.materials[signature] = material
+
+    def get_shape(self):
+        '''the custom bone shape, only created when there is none yet'''
+        if not is_valid(self.shape, bpy.data.objects):
+            self.shape = None
+            for obj in bpy.data.objects:
+                if obj.get("brg_attachpoint_shape"):
+                    self.shape = obj
+                    break
+            else:
+                self.shape = custome_shape()
+        return self.shape
+
+    def file_digest(self, file_path):
+        '''hash of the content of a file, only hashed again when it changed'''
+        stat = os.stat(file_path)
+        key = (os.path.abspath(file_path), stat.st_size, stat.st_mtime)
+        if key not in self.digests:
+            digest = hashlib.sha1()
+            with open(file_path, 'rb') as brg:
+                for block in iter(lambda: brg.read(1 << 20), b''):
+                    digest.update(block)
+            self.digests[key] = digest.hexdigest()
+        return self.digests[key]
+
+    def get_mesh(self, key):
+        '''the mesh imported before with the same key, also found in a saved blend file'''
+        mesh = self.meshes.get(key)
+        if is_valid(mesh, bpy.data.meshes):
+            return mesh
+        for mesh in bpy.data.meshes:
+            if mesh.get("brg_key") == key:
+                self.meshes[key] = mesh
+                return mesh
+        return None
+
+    def add_mesh(self, key, mesh):
+        '''remember an imported mesh by its key'''
+        mesh["brg_key"] = key
+        self.meshes[key] = mesh
+
+import_cache = ImportCache()
+
+# name of the mesh cache modifier playing an imported point cache
+POINT_CACHE = "AoM Point Cache"
+# name of the vertex group with the vertices that don't move in the animation
+STATIC_GROUP = "AoM Static"
+
+def import_key(file_path, settings, cache = import_cache):
+    '''files with the same content imported with the same frame settings give the same mesh'''
+    fps = 30 if settings.modify_fps else bpy.context.scene.render.fps
+    return "%s:%d:%d:%d:%d:%d:%d" % (cache.file_digest(file_path), settings.frame_start,
+        settings.frame_end, settings.frame_step, settings.cyclic, fps, settings.point_cache)
+
+def link_instance(context, key, cache = import_cache):
+    '''create a linked duplicate of an earlier import, returns the object or None'''
+    mesh = cache.get_mesh(key)
+    if not mesh:
+        return None
+    source = None
+    for obj in bpy.data.objects:
+        if obj.data == mesh:
+            source = obj
+            break
+
+    # the new object shares the mesh, its shape keys and materials
+    scene = context.scene
+    model = bpy.data.objects.new(source.name if source else mesh.name, mesh)
+    scene.objects.link(model)
+    model.location = scene.cursor_location
+    stats.count("linked models")
+    if source:
+        model.delta_location = source.delta_location.copy()
+
+        # the weights are kept in the shared mesh by group index,
+        # the groups are made again in the same order to give them their names
+        for group in source.vertex_groups:
+            model.vertex_groups.new(group.name)
+
+    # a point cache is played by a modifier of the object, the cache file is shared
+    if source and source.modifiers.get(POINT_CACHE):
+        cache_modifier = source.modifiers[POINT_CACHE]
+        modifier = model.modifiers.new(POINT_CACHE, 'MESH_CACHE')
+        for name in ("cache_format", "filepath", "play_mode", "time_mode"):
+            setattr(modifier, name, getattr(cache_modifier, name))
+        model.animation_data_create()
+        model.animation_data.action = source.animation_data.action
+
+    # the attachpoint armature shares its data and animation
+    for child in (source.children if source else []):
+        if child.type != 'ARMATURE':
+            continue
+        armature = bpy.data.objects.new(child.name, child.data)
+        scene.objects.link(armature)
+        armature.parent = model
+        armature.matrix_parent_inverse = child.matrix_parent_inverse.copy()
+        scene.update() # the pose of a new object is only made when the scene is evaluated
+        for bone in child.pose.bones:
+            pose_bone = armature.pose.bones[bone.name]
+            pose_bone.custom_shape = bone.custom_shape
+            pose_bone.rotation_mode = bone.rotation_mode
+            pose_bone.matrix_basis = bone.matrix_basis.copy()
+        if child.animation_data and child.animation_data.action:
+            armature.animation_data_create()
+            armature.animation_data.action = child.animation_data.action
+
+    for obj in scene.objects:
+        obj.select = False
+    model.select = True
+    scene.objects.active = model
+    return model
+
+def material_signature(material):
+    '''materials with the same texture, flags and sfx are equal'''
+    return "%d:%s:%s" % (material.props.value, material.texture_name, material.sfx_name or "")
 
 class BRGImporter:
-    def __init__(self, context, settings, addon_prefs):
+    def __init__(self, context, settings, addon_prefs, file_path = None, cache = None):
         '''set up variables, open file for reading and create new mesh'''
         self.context = context
         self.addon_prefs = addon_prefs
         self.settings = settings
+        self.cache = cache or import_cache
+        self.point_cache = None # writer of the frames, when they go to a point cache
+        self.base_vertices = None # positions of the first imported frame
+        self.frame_keys = FrameKeys() # shapekey of every frame
 
-        # open the file
-        self.file = File(self.settings.filepath, 'rb')
-        print("\n\n--<{ Importing AoM model \"" + self.file.nice_name + '" }>--')
+        # workers decoding frames are started with python, not with blender
+        if addon_prefs.workers > 1:
+            multiprocessing.set_executable(bpy.app.binary_path_python)
+
+        # open the file, parsing is done by brg_format
+        self.reader = BRGReader(file_path or self.settings.filepath)
+        self.key = import_key(self.reader.file_path, settings, self.cache)
+        self.file = self.reader.file
+        stats.file = self.reader.file_path
 
         # create a basic mesh object
         self.mesh = bpy.data.meshes.new(self.file.nice_name)
@@ -32,52 +203,76 @@ class BRGImporter:
 
     def finish_import(self):
         '''close file reading and round up scene'''
-        self.file.close()
-        # Select the imported objects
-        self.model.select = True
-        bpy.context.scene.objects.active = self.model
-        if hasattr(self, "frames"):
-            bpy.ops.object.shape_key_retime()
-
-
-
-    def read_section_head(self):
-        '''read a four letter header'''
-        return self.file.read(4)
-
-
-
-    def read_file_header(self):
-        '''read the fileheader containing basic information'''
-        file, model, mesh = self.file, self.model, self.mesh
-        file.skip(4)
-
+        with stats.stage("finish"):
+            self.reader.close()
+            self.cache.add_mesh(self.key, self.mesh)
+            # Select the imported objects
+            self.model.select = True
+            bpy.context.scene.objects.active = self.model
+            if self.point_cache:
+                self.load_point_cache()
+            elif self.mesh.shape_keys:
+                bpy.ops.object.shape_key_retime()
+            if self.base_vertices is not None and len(self.frame_ids) > 1:
+                self.load_static_vertices()
+        if hasattr(self, "armature"):
+            with stats.stage("attachpoints"):
+                self.load_attachpoint_animation()
+
+
+
+    def cancel_import(self):
+        '''close file reading and remove an unfinished point cache after a failure'''
+        self.reader.close()
+        if self.point_cache:
+            self.point_cache.discard()
+
+
+
+    def prepare_textures(self, materials):
+        '''start converting missing textures, they convert while the geometry is built.
+        Materials made before keep their image, so their textures are not needed'''
+        with stats.stage("textures"):
+            names = set(m.texture_name for m in materials
+                        if not self.cache.get_material(material_signature(m)))
+            for name in names:
+                if name not in self.cache.images:
+                    start_conversion(self.file, self.addon_prefs, name)
+
+
+
+    def load_sections(self, sections):
+        '''turn every parsed record into blender data'''
+        for head, section in sections: # reading loop
+            if head == "BANG": #Main file header
+                with stats.stage("headers"):
+                    self.load_file_header(section)
+            elif head == "ASET": #Animation definition
+                with stats.stage("headers"):
+                    self.load_animation_header(section)
+            elif head == "MESI": #Mesh data
+                with stats.stage("mesh build" if section.first_frame else "shape keys"):
+                    self.load_mesh(section, section.frame_id)
+            elif head == "MTRL": #Material settings
+                with stats.stage("materials"):
+                    self.load_materials(section)
+
+
+
+    def load_file_header(self, header):
+        '''set up the basic information from the fileheader'''
         #add basic materials
-        num_materials = file.read_uint()
         self.materials = []
-        print("Number of materials:", num_materials)
-
 
-        file.skip(4)
-        #add basis for shapekeys
-        num_shape_keys = file.read_uint()
-        print("Number of shape keys:", num_shape_keys)
-        file.skip(8)
 
 
 
-
-    def read_animation_header(self):
-        '''read animation info and set up framesettings'''
-        file, model, mesh = self.file, self.model, self.mesh
-        self.frames = file.read_uint() # amount of frames in the file for animation
-        file.skip(4)
-        self.anim_time = file.read_float()
-        file.skip(4)
-        self.spf = file.read_float()
-        self.fps = file.read_float()
-        file.skip(4)
-        print("Frames:", self.frames,"Time:", self.anim_time, "fps:", self.fps)
+    def load_animation_header(self, animation):
+        '''set up framesettings from the animation info'''
+        self.frames = animation.frames # amount of frames in the file for animation
+        self.anim_time = animation.anim_time
+        self.spf = animation.spf
+        self.fps = animation.fps
 
         # set animation settings of the scene.
         scn = bpy.context.scene
@@ -87,154 +282,190 @@ class BRGImporter:
             scn.frame_start = 1
             scn.frame_end = math.floor(self.anim_time * scn.render.fps)
         self.frame_len = self.anim_time * scn.render.fps / self.frames
-        print ("frame length", self.frame_len)
 
+        # frames within the imported range, each gets a shapekey
+        settings = self.settings
+        self.frame_ids = select_frames(self.frames,
+            settings.frame_start, settings.frame_end, settings.frame_step)
+        self.key_index = dict((f, i) for i, f in enumerate(self.frame_ids))
 
+        # or the frames are streamed to a point cache next to the file
+        if self.settings.point_cache:
+            self.start_point_cache()
 
-    def read_mesh(self, frame_id):
-        '''load a single frame, add shapekey if necessary'''
-        file, model, mesh = self.file, self.model, self.mesh
 
-        self.frame_id = frame_id
-        self.version = file.read_short() #2
-        self.format = file.read_short() #2
-        print("Frame:", frame_id, "- version:", self.version, "format:", self.format)
 
-        #vertex and face info
-        self.num_vertices = file.read_short() #2
-        self.num_faces = file.read_short() #2
-        self.state = file.read_int() #4
-        print("vertices:", self.num_vertices, "faces:", self.num_faces, "state:", self.state)
+    def start_point_cache(self):
+        '''open a pc2 file for the frame positions, in the temporary folder if the model folder is read only.
+        The name holds the import key, so other frame settings or a changed file get their own cache
+        and the cache of an earlier import keeps playing'''
+        ids = self.frame_ids
+        start = (ids[0] + 1) * self.frame_len
+        sampling = (ids[1] - ids[0]) * self.frame_len if len(ids) > 1 else 1.0
+        digest = hashlib.sha1(self.key.encode("utf-8")).hexdigest()[:10]
+        out_path = os.path.splitext(self.reader.file_path)[0] + "_" + digest
+        try:
+            self.point_cache = PC2Writer(out_path, start, sampling)
+        except (IOError, OSError):
+            out_path = os.path.join(tempfile.gettempdir(), os.path.basename(out_path))
+            self.point_cache = PC2Writer(out_path, start, sampling)
 
-        # bounding box and position
-        self.bb_center = file.read_vec3_full() #12
-        self.bb_height = file.read_float() #4
-        self.unknown_vector = file.read_vec3_full() #12
-        self.ground_pos = file.read_vec3_full() #12
-        self.ground_pos.negate()
-        if frame_id == 0:
-            model.delta_location = self.ground_pos
-        # bpy.data.objects['pos4'].parent = model
-        # bpy.data.objects['pos4'].location = (0,0,unknown03)
-        # bpy.data.objects['pos4'].keyframe_insert(data_path="location", index=-1, frame=frame_id+1)
 
-        # property flags, Very important!
-        self.props = file.read_flag() #4
-        first_frame = not self.props.has(MeshFlags.NOTFIRST) # used often
-        print ("First frame??", "No :(" if first_frame else "Yes! :)")
 
-        # bounding box corners
-        self.bb_corner_positive = file.read_vec3_full() #12
-        self.bb_corner_negative = file.read_vec3_full() #12
+    def load_point_cache(self):
+        '''play the point cache with a mesh cache modifier, keeping the original timing of the frames'''
+        self.point_cache.finish()
+        model = self.model
+        modifier = model.modifiers.new(POINT_CACHE, 'MESH_CACHE')
+        modifier.cache_format = 'PC2'
+        modifier.filepath = self.point_cache.path
+        modifier.play_mode = 'CUSTOM'
+        modifier.time_mode = 'FRAME'
 
-        # if this is the first frame, create the vertices.
-        # otherwise add an extra shapekey.
-        if first_frame:
-            mesh.from_pydata(
-                 [(0.0,0.0,0.0) for x in range(self.num_vertices)],
-                 [], [(0,0,0) for x in range(self.num_faces)])
-            mesh.uv_textures.new("UVMap")
-            print(mesh.shape_keys)
-            # if this is an animation, add shapekey
-            if hasattr(self, 'frames'):
-                for frame in range(1,self.frames+1):
-                    model.shape_key_add(str(frame))
+        # the evaluated frame is the index of the frame in the cache
+        model.animation_data_create()
+        action = bpy.data.actions.new(name=model.name + " Point Cache")
+        model.animation_data.action = action
+        fcurve = action.fcurves.new('modifiers["%s"].eval_frame' % POINT_CACHE)
+        for i, frame_num in enumerate(self.frame_ids):
+            key = fcurve.keyframe_points.insert((frame_num+1) * self.frame_len, i)
+            key.interpolation = 'LINEAR'
+        if self.settings.cyclic:
+            fcurve.modifiers.new('CYCLES')
 
-                mesh.shape_keys.animation_data_create()
-                action = bpy.data.actions.new(name="Shapekey Driver")
-                mesh.shape_keys.animation_data.action = action
-                fcurve = action.fcurves.new("eval_time")
 
-                for frame in range(1,self.frames+1):
-                    key = fcurve.keyframe_points.insert((frame) * self.frame_len, (frame) * 10)
-                    key.interpolation = 'LINEAR'
 
-                if self.settings.cyclic:
-                    fcurve.modifiers.new('CYCLES')
+    def use_frame(self, frame_id):
+        '''check if a frame needs to be decoded, the first one holds the faces'''
+        if not hasattr(self, 'frames'):
+            return True
+        return frame_id == 0 or frame_id in self.key_index
 
-                mesh.shape_keys.use_relative = False
 
-        # load the vertex placeholders
-        vertices = []
-        if hasattr(self, 'frames'):
-            model.active_shape_key_index = frame_id
-            vertices = model.active_shape_key.data
-        else:
-            vertices = model.data.vertices
 
-        # read all the vertex positions and normals
-        for vertex in vertices:
-            vertex.co = file.read_vec3()
-        for vertex in vertices:
-            file.read_vec3() # not needed in Blender
+    def load_mesh(self, frame, frame_id):
+        '''load a single frame, add shapekey if necessary'''
+        model, mesh = self.model, self.mesh
 
-        # this data only appears once at the first frame.
+        self.frame_id = frame_id
+        self.props = frame.props
+
+        # bounding box and position
+        if frame_id == 0:
+            model.delta_location = Vector(frame.ground_pos)
+
+        # property flags, Very important!
+        first_frame = frame.first_frame # used often
+
+        # if this is the first frame, create the vertices.
+        # otherwise add an extra shapekey.
         if first_frame:
-            # uv coordinates, resolved later on.
-            uvs = [file.read_vec2() for v in vertices]
+            # build the mesh in bulk from the frame arrays,
+            # the loops of every face are the face indices in order
+            num_loops = frame.num_faces * 3
+            self.loop_vertex_indices = frame.faces.ravel().astype(np.int32)
+            mesh.vertices.add(frame.num_vertices)
+            mesh.loops.add(num_loops)
+            mesh.polygons.add(frame.num_faces)
+            mesh.vertices.foreach_set("co", frame.vertices.ravel())
+            mesh.loops.foreach_set("vertex_index", self.loop_vertex_indices)
+            mesh.polygons.foreach_set("loop_start", np.arange(0, num_loops, 3, dtype=np.int32))
+            mesh.polygons.foreach_set("loop_total", np.full(frame.num_faces, 3, dtype=np.int32))
 
             # material index for faces.
             # it's set to a very high value in default brg files
             # corrected during the material reading pass
-            for face in mesh.polygons:
-                face.material_index = file.read_short()
+            mesh.polygons.foreach_set("material_index", frame.face_materials.astype(np.int32))
+            mesh.update(calc_edges=True, calc_tessface=True)
 
-            # face data
-            for face in mesh.polygons:
-                face.vertices = file.read_face()
+            # uv coordinates, gathered for every loop
+            mesh.uv_textures.new("UVMap")
+            uvs = frame.uvs[self.loop_vertex_indices]
+            mesh.uv_layers[-1].data.foreach_set("uv", uvs.ravel())
+
+        # write the vertex positions into the shapekey of this frame,
+        # or append them to the point cache.
+        # normals are not needed in Blender
+        if hasattr(self, 'frames') and frame_id in self.key_index:
+            self.find_static_vertices(frame)
+            if self.point_cache:
+                self.point_cache.add_frame(frame)
+            else:
+                self.load_shape_key(frame, frame_id)
 
-            # update the mesh data for uv loops.
-            mesh.update(calc_edges=True, calc_tessface=True)
-            uv_loops = mesh.uv_layers[-1].data
-            for loop in mesh.loops:
-                uv_loops[loop.index].uv = uvs[loop.vertex_index]
+        # vertex colors, can be animated or not
+        if frame.colors is not None:
+            if not mesh.vertex_colors:
+                mesh.vertex_colors.new('VertexColor')
+            # blender vertex colors have no alpha
+            cols = frame.colors[self.loop_vertex_indices, :3]
+            mesh.vertex_colors[0].data.foreach_set("color", cols.ravel())
 
-            if self.props.has(MeshFlags.MATERIALS): # no vertex materials in blender
-                vertmats = [file.read_short() for v in vertices]
+        if frame.attachpoints:
+            with stats.stage("attachpoints"):
+                self.load_attachpoints(frame.attachpoints)
 
-        # update mesh data in memory
-        mesh.update(calc_edges=True, calc_tessface=True)
+        bpy.context.scene.objects.active = model
 
-        file.skip(24)
-        check_space = file.read_uint() # Unkown but important flag for edge cases
 
-        if not check_space: # some optional read data, meaning not sure
-            anim_time_mult = file.read_float()
-            len_space = file.read_uint()
-            num_materials_used = file.read_uint()
 
-        # vertex colors, can be animated or not
-        if (((self.props.has(MeshFlags.TRANSPCOLOR) or
-              self.props.has(MeshFlags.CHANGINGCOL)) and
-              not self.props.has(MeshFlags.NOTFIRST)) or
-              self.props.has(MeshFlags.VERTCOLOR)):
-            cols = [file.read_color() for v in vertices]
+    def load_shape_key(self, frame, frame_id):
+        '''add a shapekey for a frame, a frame holding the one before keeps its shapekey'''
+        model, mesh = self.model, self.mesh
+        index, new = self.frame_keys.add(frame.vertices)
+        if new:
+            model.shape_key_add(str(frame_id+1), from_mix=False)
+            mesh.shape_keys.key_blocks[index].data.foreach_set("co", frame.vertices.ravel())
+            if index == 0:
+                self.start_shape_key_animation()
 
-            model.data.vertex_colors.new('VertexColor')
-            col_loops = model.data.vertex_colors[0].data
-            for loop in model.data.loops:
-                col_loops[loop.index].uv = cols[loop.vertex_index]
+        # keep the original timing of the imported frames
+        key = self.shape_key_curve.keyframe_points.insert((frame_id+1) * self.frame_len, (index+1) * 10)
+        key.interpolation = 'LINEAR'
 
-        if self.props.has(MeshFlags.ATTACHPOINTS):
-            self.read_attachpoints()
 
-        bpy.context.scene.objects.active = model
-        #optional extra space in some edge cases, meaning unsure
-        if not check_space and len_space > 0:
-            anim_time_adujst = [file.read_float() for i in range(len_space)]
+
+    def start_shape_key_animation(self):
+        '''drive the shapekeys with an animated evaluation time'''
+        shape_keys = self.mesh.shape_keys
+        shape_keys.use_relative = False
+        shape_keys.animation_data_create()
+        action = bpy.data.actions.new(name="Shapekey Driver")
+        shape_keys.animation_data.action = action
+        self.shape_key_curve = action.fcurves.new("eval_time")
+        if self.settings.cyclic:
+            self.shape_key_curve.modifiers.new('CYCLES')
 
 
 
+    def find_static_vertices(self, frame):
+        '''keep track of the vertices that move in any of the frames'''
+        if self.base_vertices is None:
+            self.base_vertices = frame.vertices.copy()
+            self.moving = np.zeros(frame.num_vertices, dtype=bool)
+        else:
+            self.moving |= np.any(frame.vertices != self.base_vertices, axis=1)
 
 
 
-    def read_attachpoints(self):
+    def load_static_vertices(self):
+        '''put the vertices that never move in a vertex group'''
+        static = np.flatnonzero(~self.moving)
+        stats.count("static vertices", len(static))
+        stats.count("reused frames", self.frame_keys.reused)
+        if len(static):
+            group = self.model.vertex_groups.new(STATIC_GROUP)
+            group.add(static.tolist(), 1.0, 'REPLACE')
+        self.settings.report({'INFO'}, "%s: %d of %d frames hold the one before, %d of %d vertices never move" % (
+            self.file.nice_name, self.frame_keys.reused, len(self.frame_ids), len(static), len(self.moving)))
+
+
+
+    def load_attachpoints(self, points):
         '''create an armature with attachpoint bones'''
         file, model, mesh = self.file, self.model, self.mesh
-        self.num_matrix = file.read_short()
-        self.num_index = file.read_short()
-        print("Matrices:", self.num_matrix, "Indexcount:", self.num_index)
-        file.skip(2)
+        self.num_matrix = points.num_matrix
+        self.num_index = points.num_index
 
         # attachpoint definitions, only happen at first frame
         if not self.props.has(MeshFlags.NOTFIRST):
@@ -256,80 +487,117 @@ class BRGImporter:
             bpy.ops.object.mode_set(mode='OBJECT')
 
             # Create and set custom shape for bones
-            shape = custome_shape()
+            shape = self.cache.get_shape()
             for bone in self.armature.pose.bones:
                 bone.custom_shape = shape
 
-        bpy.context.scene.objects.active = self.armature
+            # keep the index data for exporting, its meaning is unknown
+            data = self.armature.data
+            if points.duplicates:
+                data["brg_duplicates"] = points.duplicates
+            if points.points:
+                data["brg_points"] = points.points
+            if points.unknown_vectors is not None and len(points.unknown_vectors):
+                data["brg_unknown_vectors"] = points.unknown_vectors.ravel().tolist()
 
-        # Read armature matrix data
-        xs = [file.read_vec3() for i in range(self.num_matrix)]
-        ys = [file.read_vec3() for i in range(self.num_matrix)]
-        zs = [file.read_vec3() for i in range(self.num_matrix)]
+            self.attachpoint_times = []
+            self.attachpoint_matrices = []
 
-        # Read location, compile matrix and keyframe. Needs to change to fcurves!
-        bpy.ops.object.mode_set(mode='POSE')
+        # collect the matrices, they are keyed all at once at the end
         if hasattr(self, 'frames'):
-            bpy.context.scene.frame_set((self.frame_id + 1) * self.frame_len)
-        for i,m in enumerate(zip(zs,ys,xs)):
-            m = Matrix(m).transposed().to_4x4()
-            m.translation = file.read_vec3()
-            self.armature.pose.bones[str(i)].matrix = m
+            if self.frame_id not in self.key_index:
+                return
+            self.attachpoint_times.append((self.frame_id + 1) * self.frame_len)
+        self.attachpoint_matrices.append(points.matrices)
+
+        # Attachpoint names. Not correct yet!
+        # for i, point in enumerate(points.points):
+        #     pose.bones[str(i)].name = NODE_NAMES[point]
+        #     print(NODE_NAMES[point], str(i),str(point))
+
 
-        unknown_vectors = [file.read_vec3() for i in range(self.num_matrix*2)]
 
-        if hasattr(self, 'frames'):
-            bpy.ops.pose.select_all(action='SELECT')
-            bpy.ops.anim.keyframe_insert(type='LocRotScale')
-        bpy.ops.object.mode_set(mode='OBJECT')
 
-        # Read attachpoint names. Not correct yet!
-        num_points = 0
-        print ("Number of indexes:",self.num_index)
-        for i in range(self.num_index):
-            dupli = file.read_int()
-            file.skip(4)
-            num_points += dupli
 
-        for i in range(num_points):
-            point = file.read_byte()
-            # pose.bones[str(i)].name = NODE_NAMES[point]
-            # print(NODE_NAMES[point], str(i),str(point))
+    def load_attachpoint_animation(self):
+        '''pose or animate the attachpoint bones with the matrices of all frames'''
+        bones = self.armature.pose.bones
 
+        # without animation the bones are only posed
+        if not self.attachpoint_times:
+            for i,m in enumerate(self.attachpoint_matrices[0].tolist()):
+                bones[str(i)].matrix_basis = Matrix(m)
+            return
 
+        # the bones have an identity rest pose, so the matrices are the basis
+        matrices = np.array(self.attachpoint_matrices)
+        locations, rotations, scales = decompose_matrices(matrices)
+        times = np.array(self.attachpoint_times, dtype=np.float32)
 
+        self.armature.animation_data_create()
+        action = bpy.data.actions.new(name=self.armature.name + " Action")
+        self.armature.animation_data.action = action
 
+        keyframes = np.empty((len(times), 2), dtype=np.float32)
+        keyframes[:, 0] = times
+        for i in range(self.num_matrix):
+            bones[str(i)].rotation_mode = 'QUATERNION'
+            for path, values in (("location", locations),
+                                 ("rotation_quaternion", rotations),
+                                 ("scale", scales)):
+                data_path = 'pose.bones["%d"].%s' % (i, path)
+                for index in range(values.shape[-1]):
+                    fcurve = action.fcurves.new(data_path, index, str(i))
+                    fcurve.keyframe_points.add(len(times))
+                    keyframes[:, 1] = values[:, i, index]
+                    fcurve.keyframe_points.foreach_set("co", keyframes.ravel())
+                    fcurve.update()
 
-    def read_materials(self):
+
+
+
+
+    def load_materials(self, material):
         '''fill in material data and add nodes'''
         file, model, mesh = self.file, self.model, self.mesh
 
         # read the material header data
         index = len(mesh.materials)
-        self.matid = file.read_uint()
-        self.props = file.read_flag()
-        print("Material", index, "with id:", self.matid)
-
-        # Create new material and add to mesh
-        self.material = bpy.data.materials.new(str(self.matid))
-        self.material.use_nodes = True
+        self.matid = material.matid
+        self.props = material.props
+
+        # Create new material or reuse an equal one of an earlier import, and add to mesh
+        signature = material_signature(material)
+        self.material = self.cache.get_material(signature)
+        new_material = self.material is None
+        if new_material:
+            self.material = bpy.data.materials.new(material.texture_name or str(self.matid))
+            self.material.use_nodes = True
+            self.cache.add_material(signature, self.material)
+            # keep the game settings for exporting
+            self.material["brg_matid"] = material.matid
+            self.material["brg_flags"] = material.props.value
+            self.material["brg_texture"] = material.texture_name
+            if material.sfx_name:
+                self.material["brg_sfx"] = material.sfx_name
         node_tree = self.material.node_tree
         mesh.materials.append(self.material)
 
         # update the face material index data to the blender index.
-        for face in mesh.polygons:
-            if face.material_index == self.matid:
-                face.material_index = index
-
-        # texture settings
-        file.skip(4)
-        name_length = file.read_uint()
-        file.skip(48) # unknown data
-        texture_name = file.read(name_length)
-        file.skip(4)
-
-        # load or convert the image.
-        img = load_image(file, self.addon_prefs, texture_name)
+        face_materials = np.empty(len(mesh.polygons), dtype=np.int32)
+        mesh.polygons.foreach_get("material_index", face_materials)
+        face_materials[face_materials == self.matid] = index
+        mesh.polygons.foreach_set("material_index", face_materials)
+
+        if not new_material:
+            return
+
+        # load or convert the image, once per batch.
+        name = material.texture_name
+        if name not in self.cache.images:
+            with stats.stage("textures"):
+                self.cache.images[name] = load_image(file, self.addon_prefs, name)
+        img = self.cache.images[name]
         if img:
             # setup the cycles material
             node_texture = node_tree.nodes.new(type='ShaderNodeTexImage')
@@ -339,8 +607,66 @@ class BRGImporter:
             links = node_tree.links
             link = links.new(node_texture.outputs[0], node_tree.nodes.get("Diffuse BSDF").inputs[0])
 
-        # optional sfx data
-        if self.props.has(MatrFlags.SFX):
-            file.skip(2)
-            sfx_length = file.read_short()
-            sfx_name = file.read(sfx_length)
+
+
+def import_files(context, settings, addon_prefs, file_paths):
+    '''import a batch of files, parsing them concurrently while the blender data is built'''
+    cache = import_cache
+    cache.start_batch()
+    report = [] # file path, parse time, build time, error
+
+    # files are parsed in worker processes, or in one background thread
+    if addon_prefs.workers > 1:
+        multiprocessing.set_executable(bpy.app.binary_path_python)
+        pool = ProcessPoolExecutor(max_workers=addon_prefs.workers)
+    else:
+        pool = ThreadPoolExecutor(max_workers=1)
+
+    # files imported before, or twice in this batch, are only parsed once
+    keys = [import_key(path, settings, cache) for path in file_paths]
+    pending, planned = [], set()
+    for path, key in zip(file_paths, keys):
+        if key not in planned and not cache.get_mesh(key):
+            planned.add(key)
+            pending.append((path, key))
+    pending.reverse()
+
+    # the parsed frames of a file stay in memory until it is built,
+    # so only a few files are parsed ahead of the one being built
+    window = 2 * max(1, addon_prefs.workers)
+    futures = {}
+    def parse(path):
+        return pool.submit(read_file_sections, path, settings.frame_start,
+                           settings.frame_end, settings.frame_step)
+    def parse_ahead():
+        while pending and len(futures) < window:
+            path, key = pending.pop()
+            futures[key] = parse(path)
+
+    with pool:
+        parse_ahead()
+        for path, key in zip(file_paths, keys):
+            parse_time = build_time = 0.0
+            importer = None
+            try:
+                start = time.time()
+                if link_instance(context, key, cache):
+                    report.append((path, parse_time, time.time() - start, None))
+                    continue
+                # a file failing before is parsed again for its duplicate
+                future = futures.pop(key, None) or parse(path)
+                parse_ahead()
+                sections, parse_time = future.result()
+                stats.add_stage("parse", parse_time)
+                start = time.time()
+                importer = BRGImporter(context, settings, addon_prefs, path, cache)
+                importer.prepare_textures([section for head, section in sections if head == "MTRL"])
+                importer.load_sections(sections)
+                importer.finish_import()
+                build_time = time.time() - start
+                report.append((path, parse_time, build_time, None))
+            except Exception as e:
+                if importer:
+                    importer.cancel_import()
+                report.append((path, parse_time, build_time, str(e)))
+    return report
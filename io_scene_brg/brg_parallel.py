@@ -0,0 +1,83 @@
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+try:
+    from multiprocessing import shared_memory
+except ImportError: # before python 3.8 the arrays are sent back pickled
+    shared_memory = None
+from .brg_format import BRGReader
+
+'''Decoding of brg frames in a pool of worker processes'''
+
+def frame_layout(sections):
+    '''offsets of the vertices, normals and matrices of every frame in one shared block'''
+    layout, size = [], 0
+    for section in sections:
+        header = section.header
+        num_matrix = header.attachpoints.num_matrix if header.attachpoints else 0
+        offsets = []
+        for shape in ((header.num_vertices, 3), (header.num_vertices, 3), (num_matrix, 4, 4)):
+            offsets.append((size, shape))
+            size += int(np.prod(shape)) * 4
+        layout.append(offsets)
+    return layout, size
+
+def write_arrays(buffer, offsets, arrays):
+    '''copy arrays into the shared block'''
+    for (offset, shape), array in zip(offsets, arrays):
+        if array is not None:
+            np.ndarray(shape, np.float32, buffer, offset)[...] = array
+
+def read_arrays(buffer, offsets):
+    '''copy arrays out of the shared block'''
+    return [np.ndarray(shape, np.float32, buffer, offset).copy() for offset, shape in offsets]
+
+def decode_chunk(file_path, jobs, shared_name):
+    '''decode a list of frames inside a worker process'''
+    reader = BRGReader(file_path)
+    shared = shared_memory.SharedMemory(name=shared_name) if shared_name else None
+    frames = []
+    try:
+        for section, offsets in jobs:
+            frame = reader.read_section(section)
+            if shared: # the big arrays go through shared memory instead of the pipe
+                points = frame.attachpoints
+                write_arrays(shared.buf, offsets,
+                             (frame.vertices, frame.normals, points and points.matrices))
+                frame.vertices = frame.normals = None
+                if points:
+                    points.matrices = None
+            frames.append(frame)
+    finally:
+        reader.close()
+        if shared:
+            shared.close()
+    return frames
+
+def decode_frames(file_path, sections, workers):
+    '''decode the frames of the indexed sections in a process pool, yielding them in order'''
+    layout, size = frame_layout(sections)
+    shared = None
+    if shared_memory:
+        shared = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    jobs = list(zip(sections, layout))
+    chunk = max(1, len(jobs) // (workers * 4)) # a few chunks per worker to balance the load
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = []
+            for start in range(0, len(jobs), chunk):
+                futures.append((start, pool.submit(decode_chunk, file_path,
+                    jobs[start:start + chunk], shared and shared.name)))
+
+            for start, future in futures:
+                for frame, offsets in zip(future.result(), layout[start:start + chunk]):
+                    if shared:
+                        vertices, normals, matrices = read_arrays(shared.buf, offsets)
+                        frame.vertices, frame.normals = vertices, normals
+                        if frame.attachpoints:
+                            frame.attachpoints.matrices = matrices
+                    yield frame
+    finally:
+        if shared:
+            shared.close()
+            shared.unlink()
@@ -1,12 +1,23 @@
 import struct
 from struct import pack,unpack
 import os
-import mathutils
 import math
-import bpy
+import time
+import mmap
 import shutil
 import subprocess
+import threading
+import json
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 from enum import Enum
+try: # only available inside of Blender, the file helpers work without them
+    import bpy
+    import mathutils
+except ImportError:
+    bpy = mathutils = None
+from .brg_ddt import read_ddt, DDTError
 
 '''Quick functions for helping read brg files'''
 
@@ -100,19 +111,63 @@ class File:
         a = self.read_byte()
         return (r/255.0,g/255.0,b/255.0,a/255.0)
 
+    def read_block(self, length):
+        '''read a block of raw bytes from file'''
+        return self.file_object.read(length)
+
+    def read_half_array(self, length):
+        '''read an array of half floating numbers in one block'''
+        data = np.frombuffer(self.read_block(length * 2), dtype='<u2')
+        # shift the truncated bits in place to get full float32 values
+        return (data.astype(np.uint32) << 16).view(np.float32)
+
+    def read_vec2_array(self, length):
+        '''reads an array of vectors with two dimensions'''
+        return self.read_half_array(length * 2).reshape(length, 2)
+
+    def read_vec3_array(self, length):
+        '''reads an array of vectors with three dimensions, y and z swapped'''
+        data = self.read_half_array(length * 3).reshape(length, 3)
+        return np.ascontiguousarray(data[:, (0,2,1)])
+
+    def read_short_array(self, length):
+        '''read an array of unsigned shorts'''
+        data = np.frombuffer(self.read_block(length * 2), dtype='<u2')
+        return data.astype(np.uint16)
+
+    def read_face_array(self, length):
+        '''reads an array of face indices with three dimensions'''
+        data = self.read_short_array(length * 3).reshape(length, 3)
+        return np.ascontiguousarray(data[:, (0,2,1)])
+
+    def read_color_array(self, length):
+        '''reads an array of byte vectors with four dimensions'''
+        data = np.frombuffer(self.read_block(length * 4), dtype=np.uint8)
+        return data.reshape(length, 4) / np.float32(255.0)
+
     def skip(self, length):
         '''move the read pointer forward with length'''
         self.file_object.seek(length, 1)
 
     def write_empty(self, length):
         '''move the write pointer forward with length'''
-        s = "\x00" * length
-        self.file_object.write(s)
+        self.file_object.write(b"\x00" * length)
 
     def write(self, data):
         '''write a ascii string'''
         self.file_object.write(str(data).encode('ascii'))
 
+    def tell(self):
+        '''get the position of the write pointer'''
+        return self.file_object.tell()
+
+    def patch(self, offset, layout, data):
+        '''overwrite a scalar written earlier'''
+        end = self.file_object.tell()
+        self.file_object.seek(offset)
+        self.file_object.write(layout.pack(data))
+        self.file_object.seek(end)
+
     def write_byte(self, data):
         '''write unsigned byte to file'''
         self.file_object.write(pack('B', data))
@@ -130,17 +185,17 @@ class File:
         self.file_object.write(pack('H', data))
 
     def write_flag(self, data):
-        '''write flag to file'''
-        self.write_int(data.value)
+        '''write flag to file, negative values are read back the same'''
+        self.write_uint(data.value & 0xFFFFFFFF)
 
     def write_float(self, data):
         '''write floating point to file'''
-        self.file_object.write(self, pack('f', data))
+        self.file_object.write(pack('f', data))
 
     def write_half(self, data):
         '''write half floating point to file'''
         f = pack('f', data)[-2:]
-        self.file_object.write(self, f)
+        self.file_object.write(f)
 
     def write_vec2(self, vec):
         '''write a vector with two dimensions'''
@@ -169,6 +224,363 @@ class File:
         self.write_short(y)
         self.write_short(z)
 
+    def write_block(self, data):
+        '''write a block of raw bytes to file'''
+        self.file_object.write(data)
+
+    def write_half_array(self, array):
+        '''write an array as half floating numbers in one block'''
+        bits = np.ascontiguousarray(array, dtype='<f4').view('<u4')
+        # keep the upper bits of every float32, rounded to the nearest value.
+        # inf and nan, and values that would round up to them, are cut off like write_half does
+        halves = bits >> 16
+        rounded = halves + ((bits >> 15) & 1)
+        special = ((halves & 0x7F80) == 0x7F80) | ((rounded & 0x7F80) == 0x7F80)
+        halves = np.where(special, halves, rounded)
+        self.write_block(halves.astype('<u2').tobytes())
+
+    def write_vec2_array(self, array):
+        '''write an array of vectors with two dimensions'''
+        self.write_half_array(array)
+
+    def write_vec3_array(self, array):
+        '''write an array of vectors with three dimensions, y and z swapped'''
+        self.write_half_array(np.asarray(array)[:, (0,2,1)])
+
+    def write_short_array(self, array):
+        '''write an array of unsigned shorts'''
+        self.write_block(np.ascontiguousarray(array, dtype='<u2').tobytes())
+
+    def write_face_array(self, array):
+        '''write an array of face indices with three dimensions'''
+        self.write_short_array(np.asarray(array)[:, (0,2,1)])
+
+    def write_color_array(self, array):
+        '''write an array of float colors as byte vectors with four dimensions'''
+        data = np.clip(np.round(np.asarray(array) * 255.0), 0, 255)
+        self.write_block(data.astype(np.uint8).tobytes())
+
+# precompiled layouts of the scalar types
+BYTE = struct.Struct('<B')
+SHORT = struct.Struct('<H')
+UINT = struct.Struct('<I')
+INT = struct.Struct('<i')
+FLOAT = struct.Struct('<f')
+
+# Memory mapped file reading, the read pointer is just an offset.
+class MappedFile(File):
+    small_file = 1 << 20 # files below this size are loaded as bytes instead
+
+    def __init__(self, file_path):
+        File.__init__(self, file_path, 'rb')
+        size = os.fstat(self.file_object.fileno()).st_size
+        if size < self.small_file:
+            self.map = None
+            self.data = memoryview(self.file_object.read())
+        else:
+            self.map = mmap.mmap(self.file_object.fileno(), 0, access=mmap.ACCESS_READ)
+            self.data = memoryview(self.map)
+        self.size = size
+        self.offset = 0
+
+    def close(self):
+        '''release the mapped data and close the file object'''
+        self.data.release()
+        if self.map:
+            self.map.close()
+        self.file_object.close()
+
+    def tell(self):
+        '''get the position of the read pointer'''
+        return self.offset
+
+    def seek(self, offset):
+        '''move the read pointer to an absolute offset'''
+        self.offset = offset
+
+    def skip(self, length):
+        '''move the read pointer forward with length'''
+        self.offset += length
+
+    def read_block(self, length):
+        '''get a memoryview on the next block of bytes, without copying'''
+        start = self.offset
+        self.offset += length
+        if self.offset > self.size:
+            raise EOFError("Unexpected end of file in %s" % self.name)
+        return self.data[start:self.offset]
+
+    def read(self, length = 1):
+        '''read string with length from file'''
+        try:
+            return self.read_block(length).tobytes().decode("utf-8")
+        except:
+            return False
+
+    def unpack(self, layout):
+        '''read a single scalar with a precompiled layout'''
+        data = layout.unpack_from(self.data, self.offset)[0]
+        self.offset += layout.size
+        return data
+
+    def read_byte(self):
+        '''read unsigned byte from file'''
+        return self.unpack(BYTE)
+
+    def read_short(self):
+        '''read unsgned short from file'''
+        return self.unpack(SHORT)
+
+    def read_uint(self):
+        '''read unsigned integer from file'''
+        return self.unpack(UINT)
+
+    def read_int(self):
+        '''read signed integer from file'''
+        return self.unpack(INT)
+
+    def read_float(self):
+        '''read floating point number from file'''
+        return self.unpack(FLOAT)
+
+    def read_half(self):
+        '''read half floating number from file'''
+        return FLOAT.unpack(b'\x00\x00' + self.read_block(2).tobytes())[0]
+
+# Buffered file writing to a temporary file that replaces the target when closing.
+# Full buffers are spilled, so memory stays flat no matter how long the file gets.
+class BufferedFile(File):
+    flush_size = 1 << 22 # spill the buffer to the temporary file beyond this size
+
+    def __init__(self, file_path, size = 0):
+        self.target = os.path.abspath(file_path)
+        self.name = os.path.basename(self.target)
+        self.file_path = os.path.dirname(self.target)
+        self.nice_name = os.path.splitext(self.name)[0].title()
+        self.buffer = bytearray(size)
+        self.offset = 0 # end of the data in the buffer
+        self.flushed = 0 # bytes already in the temporary file
+        self.temp_path = self.target + ".tmp"
+        self.temp = None
+
+    def reserve(self, length):
+        '''make sure the buffer can hold length more bytes'''
+        if self.offset >= self.flush_size:
+            self.flush()
+        needed = self.offset + length
+        if needed > len(self.buffer):
+            self.buffer.extend(bytes(max(needed, len(self.buffer) * 2) - len(self.buffer)))
+
+    def flush(self):
+        '''append the buffered data to the temporary file and reuse the buffer'''
+        if not self.temp:
+            self.temp = open(self.temp_path, 'wb')
+        self.temp.write(memoryview(self.buffer)[:self.offset])
+        self.flushed += self.offset
+        self.offset = 0
+
+    def tell(self):
+        '''get the position of the write pointer'''
+        return self.flushed + self.offset
+
+    def patch(self, offset, layout, data):
+        '''overwrite a scalar written earlier, in the buffer or in the temporary file'''
+        if offset >= self.flushed:
+            layout.pack_into(self.buffer, offset - self.flushed, data)
+        else:
+            self.temp.seek(offset)
+            self.temp.write(layout.pack(data))
+            self.temp.seek(self.flushed)
+
+    def pack(self, layout, data):
+        '''write a single scalar with a precompiled layout'''
+        self.reserve(layout.size)
+        layout.pack_into(self.buffer, self.offset, data)
+        self.offset += layout.size
+
+    def write_block(self, data):
+        '''copy a block of bytes into the buffer'''
+        length = len(data)
+        self.reserve(length)
+        self.buffer[self.offset:self.offset + length] = data
+        self.offset += length
+
+    def write_empty(self, length):
+        '''write length zero bytes'''
+        self.write_block(bytes(length))
+
+    def write(self, data):
+        '''write a ascii string'''
+        self.write_block(str(data).encode('ascii'))
+
+    def write_byte(self, data):
+        '''write unsigned byte to file'''
+        self.pack(BYTE, data)
+
+    def write_uint(self, data):
+        '''write unsigned integer to file'''
+        self.pack(UINT, data)
+
+    def write_int(self, data):
+        '''write signed integer to file'''
+        self.pack(INT, data)
+
+    def write_short(self, data):
+        '''write unsigned short to file'''
+        self.pack(SHORT, data)
+
+    def write_float(self, data):
+        '''write floating point to file'''
+        self.pack(FLOAT, data)
+
+    def write_half(self, data):
+        '''write half floating point to file'''
+        self.write_block(FLOAT.pack(data)[-2:])
+
+    def close(self):
+        '''write the rest of the buffer and move the temporary file in place,
+        so the target is never left half written'''
+        try:
+            self.flush()
+            self.temp.flush()
+            os.fsync(self.temp.fileno())
+            self.temp.close()
+            os.replace(self.temp_path, self.target)
+        except OSError:
+            self.discard()
+            raise
+        self.buffer = bytearray()
+
+    def discard(self):
+        '''drop everything without touching the target'''
+        if self.temp:
+            self.temp.close()
+            if os.path.exists(self.temp_path):
+                os.remove(self.temp_path)
+            self.temp = None
+        self.buffer = bytearray()
+        self.offset = self.flushed = 0
+
+# Timing of a single stage, used as a context manager.
+# Time spent in stages entered within it is only counted for those.
+class StageTimer:
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+
+    def __enter__(self):
+        self.nested = 0.0
+        self.stats.stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.start
+        stack = self.stats.stack
+        stack.pop()
+        if stack:
+            stack[-1].nested += seconds
+        self.stats.add_stage(self.name, seconds - self.nested)
+        return False
+
+# Stage used when nothing is recorded.
+class NoStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+NO_STAGE = NoStage()
+
+# Wall time, bytes and element counts of every section and stage of an import or export.
+# Nothing is recorded unless it is enabled in the preferences.
+class Stats:
+    def __init__(self):
+        self.enabled = False
+        self.reset("")
+
+    def reset(self, name):
+        '''forget everything recorded before'''
+        self.name = name
+        self.file = ""
+        self.start = time.time()
+        self.sections = []
+        self.stages = {} # name to [seconds, calls]
+        self.stack = [] # stages that are running
+        self.counters = {}
+
+    def begin(self, name, enabled):
+        '''start recording an import or export'''
+        self.enabled = enabled
+        self.reset(name)
+
+    def stage(self, name):
+        '''time a stage with a with statement, a stage can be entered many times'''
+        if not self.enabled:
+            return NO_STAGE
+        return StageTimer(self, name)
+
+    def add_stage(self, name, seconds):
+        '''add the time of a call of a stage'''
+        if not self.enabled:
+            return
+        stage = self.stages.setdefault(name, [0.0, 0])
+        stage[0] += seconds
+        stage[1] += 1
+
+    def section(self, head, offset, size, seconds, counts = None, file = None):
+        '''record a section of a file, by default of the file being imported or exported'''
+        if self.enabled:
+            self.sections.append({"file": file or self.file, "head": head, "offset": offset,
+                "bytes": size, "seconds": seconds, "counts": counts or {}})
+
+    def count(self, name, amount = 1):
+        '''add to a counter'''
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def as_dict(self):
+        '''everything recorded, with the totals of every kind of section'''
+        totals = {}
+        for section in self.sections:
+            total = totals.setdefault(section["head"], {"sections": 0, "bytes": 0, "seconds": 0.0})
+            total["sections"] += 1
+            total["bytes"] += section["bytes"]
+            total["seconds"] += section["seconds"]
+        return {
+            "name": self.name,
+            "seconds": time.time() - self.start,
+            "stages": dict((name, {"seconds": t, "calls": c}) for name, (t, c) in self.stages.items()),
+            "counters": self.counters,
+            "section_totals": totals,
+            "sections": self.sections,
+            }
+
+    def summary(self):
+        '''a single line with the total time and the slowest stage'''
+        seconds = time.time() - self.start
+        line = "%s in %.2fs" % (self.name, seconds)
+        if self.stages:
+            name, (slowest, calls) = max(self.stages.items(), key=lambda s: s[1][0])
+            line += ", slowest stage %s %.2fs" % (name, slowest)
+        size = sum(s["bytes"] for s in self.sections)
+        if size:
+            line += ", %d sections, %.1f MB" % (len(self.sections), size / 1e6)
+        return line
+
+    def write_json(self, path):
+        '''write the report as json, returns the path'''
+        with open(path, 'w') as report:
+            json.dump(self.as_dict(), report, indent=1)
+        return path
+
+stats = Stats()
+
+def report_path(name, kind):
+    '''where the json report of an import or export is written'''
+    return os.path.join(tempfile.gettempdir(), "%s_%s_report.json" % (name, kind))
+
 # names of attachpoints possible in the game.
 NODE_NAMES = "TARGETPOINT LAUNCHPOINT CORPSE DECAL FIRE GATHERPOINT RESERVED9 RESERVED8 RESERVED7 RESERVED6 RESERVED5 RESERVED4 RESERVED3 RESERVED2 RESERVED1 RESERVED0 SMOKE9 SMOKE8 SMOKE7 SMOKE6 SMOKE5 SMOKE4 SMOKE3 SMOKE2 SMOKE1 SMOKE0 GARRISONFLAG HITPOINTBAR RIGHTFOREARM LEFTFOREARM RIGHTFOOT LEFTFOOT RIGHTLEG LEFTLEG RIGHTTHIGH LEFTTHIGH PELVIS BACKABDOMEN FRONTABDOMEN BACKCHEST FRONTCHEST RIGHTSHOULDER LEFTSHOULDER NECK RIGHTEAR LEFTEAR CHIN FACE FOREHEAD TOPOFHEAD RIGHTHAND LEFTHAND RESERVED SMOKEPOINT ATTACHPOINT".split()
 
@@ -226,10 +638,15 @@ def custome_shape():
         cus_obj.data.polygons[x].material_index = m
     cus_obj.data.update(calc_edges=True, calc_tessface=True)
     cus_obj.use_fake_user = True
+    cus_obj["brg_attachpoint_shape"] = True
     mesh.show_double_sided = True
 
-    #create three materials for each axis
+    #create three materials for each axis, reusing the ones of an earlier shape
     for i,c in enumerate([(1,0,0),(0,1,0),(0,0,1)]):
+        mat = bpy.data.materials.get("_custom_shape." + str(i))
+        if mat:
+            cus_obj.data.materials.append(mat)
+            continue
         mat = bpy.data.materials.new("_custom_shape." + str(i))
         mat.use_nodes = True
         mat.diffuse_color = c
@@ -240,45 +657,189 @@ def custome_shape():
     return cus_obj
 
 
-def copy_ddt(file, addon_prefs, file_path, texture_name):
-    '''copy the texture from another place, convert it if TextureExtrator is found'''
-    compiler = os.path.join(addon_prefs.comp_path, 'TextureExtractor.exe')
-    tex_path = os.path.join(addon_prefs.aom_path, "textures", texture_name) + '.ddt'
-    new_path = os.path.join(file_path, texture_name) + '.tga'
+# cached listings of the texture folders, refreshed when a folder changes
+class TextureIndex:
+    def __init__(self):
+        self.folders = {} # folder path to (mtime, {lower case name: name})
 
-    if os.path.isfile(os.path.join(file.file_path, texture_name) + '.ddt'):
-        tex_path = os.path.join(file.file_path, texture_name) + '.ddt'
-
-    if os.path.isfile(new_path): #file already exsists localy
-        return bpy.data.images.load(new_path)
-
-    #try to convert the image from ddt using the TextureExtractor.exe
-    if (os.path.isfile(compiler) and os.path.isfile(tex_path)):
-        print("Trying to convert image to ddt...")
-        FNULL = open(os.devnull, 'w')
-        args = '"' + compiler + '" -o "' + new_path + '" -i "' + tex_path + '"'
-        # print(args)
-        subprocess.call(args, stdout=FNULL, stderr=FNULL, shell=False)
-        if os.path.isfile(new_path):
-            print("Succefully converted to:")
-            print(new_path)
-            return bpy.data.images.load(new_path)
+    def list_folder(self, folder):
+        '''get the files of a folder, only reading it again when its mtime changed'''
+        try:
+            mtime = os.stat(folder).st_mtime
+        except OSError:
+            return {}
+        cached = self.folders.get(folder)
+        if cached and cached[0] == mtime:
+            return cached[1]
+
+        if hasattr(os, 'scandir'):
+            names = [entry.name for entry in os.scandir(folder) if entry.is_file()]
         else:
-            print("Failed to convert")
-    else:
-        print("Original .ddt does not exsist or TextureExtractor.exe not found")
+            names = os.listdir(folder)
+        files = dict((name.lower(), name) for name in names)
+        self.folders[folder] = (mtime, files)
+        return files
+
+    def find(self, path, exts):
+        '''find path with one of the extensions, returns the full path or None'''
+        folder, name = os.path.split(os.path.abspath(path))
+        files = self.list_folder(folder)
+        for ext in exts:
+            found = files.get((name + ext).lower())
+            if found:
+                return os.path.join(folder, found)
+        return None
 
-    # try ot copy the raw ddt over
+texture_index = TextureIndex()
+
+# images of the blend file by their normalized path, so looking up an image never scans them all
+class ImageIndex:
+    def __init__(self):
+        self.images = {} # normalized path to image
+        self.indexed = False
+
+    def refresh(self):
+        '''add the images loaded by the user or by an earlier session, once per import'''
+        self.images = dict((key, img) for key, img in self.images.items() if self.valid(img))
+        for img in bpy.data.images:
+            if img.filepath:
+                self.images[os.path.normcase(os.path.abspath(bpy.path.abspath(img.filepath)))] = img
+        self.indexed = True
+
+    def valid(self, img):
+        try:
+            return img.name in bpy.data.images
+        except ReferenceError: # removed from the blend file
+            return False
+
+    def get(self, key):
+        '''the image of a normalized path, None if it isn't loaded'''
+        if not self.indexed:
+            self.refresh()
+        img = self.images.get(key)
+        return img if img and self.valid(img) else None
+
+    def add(self, key, img):
+        self.images[key] = img
+
+loaded_images = ImageIndex()
+
+def get_image(path):
+    '''get the image of path from bpy.data.images, loading it only when needed'''
+    key = os.path.normcase(os.path.abspath(path))
+    img = loaded_images.get(key)
+    if img:
+        return img
     try:
-        print("Trying to copy image from AoM install folder...")
-        shutil.copy(aom_path, file_path)
-        if os.path.isfile(new_path): #file is succesfuly coppied
-            return None
-    except:
+        img = bpy.data.images.load(path)
+    except RuntimeError:
         return None
+    loaded_images.add(key, img)
+    return img
 
-def load_image(file, addon_prefs, texture_name):
-    '''search for the texture nearby or convert it and load it in blender'''
+# external program converting .ddt textures, swappable for another executable
+class TextureExtractor:
+    def __init__(self, executable):
+        self.executable = executable
+
+    def command(self, source, target):
+        '''arguments to convert source to target'''
+        return [self.executable, '-o', target, '-i', source]
+
+    def convert(self, source, target):
+        '''run the conversion, returns if the target was written'''
+        with open(os.devnull, 'w') as FNULL:
+            subprocess.call(self.command(source, target), stdout=FNULL, stderr=FNULL, shell=False)
+        return os.path.isfile(target)
+
+def get_converter(addon_prefs):
+    '''the TextureExtractor from the preferences, None if it isn't installed'''
+    compiler = os.path.join(addon_prefs.comp_path, 'TextureExtractor.exe')
+    if os.path.isfile(compiler):
+        return TextureExtractor(compiler)
+    return None
+
+# converts textures in a bounded thread pool, remembering converted files on disk
+class DDTPipeline:
+    cache_name = ".ddt_cache.json"
+
+    def __init__(self, workers = 4):
+        self.workers = workers
+        self.pool = None
+        self.jobs = {} # target path to future
+        self.decodes = {} # ddt path to future of its pixels
+        self.caches = {} # folder to {target name: [source, size, mtime]}
+        self.lock = threading.Lock()
+
+    def convert(self, converter, source, target):
+        '''start converting source to target, returns a future telling if it succeeded'''
+        job = self.jobs.get(target)
+        if job and not job.done():
+            return job
+        if not self.pool:
+            self.pool = ThreadPoolExecutor(max_workers=self.workers)
+        job = self.pool.submit(self.run, converter, source, target)
+        self.jobs[target] = job
+        return job
+
+    def decode(self, source):
+        '''start decoding a ddt in memory, returns a future of the pixels'''
+        job = self.decodes.get(source)
+        if job:
+            return job
+        if not self.pool:
+            self.pool = ThreadPoolExecutor(max_workers=self.workers)
+        job = self.pool.submit(read_ddt, source)
+        self.decodes[source] = job
+        return job
+
+    def run(self, converter, source, target):
+        '''convert unless the target was made from the same source before'''
+        stat = os.stat(source)
+        key = [source, stat.st_size, stat.st_mtime]
+        folder, name = os.path.split(target)
+        with self.lock:
+            cache = self.load_cache(folder)
+            entry = cache.get(name)
+        if os.path.isfile(target) and entry in (None, key):
+            if entry is None: # converted before the cache existed
+                self.save_entry(folder, name, key)
+            return True
+
+        if not converter.convert(source, target):
+            print("Failed to convert", source)
+            return False
+        self.save_entry(folder, name, key)
+        return True
+
+    def load_cache(self, folder):
+        '''read the cache file of a folder once'''
+        if folder not in self.caches:
+            try:
+                with open(os.path.join(folder, self.cache_name)) as cache_file:
+                    self.caches[folder] = json.load(cache_file)
+            except (OSError, ValueError):
+                self.caches[folder] = {}
+        return self.caches[folder]
+
+    def save_entry(self, folder, name, key):
+        '''remember a converted texture'''
+        with self.lock:
+            cache = self.load_cache(folder)
+            cache[name] = key
+            try:
+                with open(os.path.join(folder, self.cache_name), 'w') as cache_file:
+                    json.dump(cache, cache_file)
+            except OSError:
+                pass
+
+ddt_pipeline = DDTPipeline()
+
+# all possible extensions in a list
+IMAGE_EXTS = ['.png', '.tga', '.bmp', '.jpg', '.jpeg']
+
+def texture_folders(file, addon_prefs):
+    '''folders to search for textures and the folder to store conversions in'''
     converted_path = os.path.join(addon_prefs.aom_path, "textures\\converted")
     if (addon_prefs.glob_tex and
             not os.path.exists(converted_path) and
@@ -287,45 +848,125 @@ def load_image(file, addon_prefs, texture_name):
 
     # Use specified global path otherwise use default textures\converted.
     glob_path = addon_prefs.tex_path if addon_prefs.tex_path else converted_path
-    # print(glob_path)
-    paths = [ # all possible paths in a list
-        os.path.join(file.file_path, texture_name),
-        os.path.join(bpy.path.abspath("//"), texture_name),
-        os.path.join(glob_path, texture_name) if addon_prefs.glob_tex else ""]
-    exts = [ # all possible extensions in a list
-        '.png',
-        '.tga',
-        '.bmp',
-        '.jpg',
-        '.jpeg']
-    # print(paths, file.addon_prefs.tex_path)
+    folders = [ # all possible paths in a list
+        file.file_path,
+        bpy.path.abspath("//"),
+        glob_path if addon_prefs.glob_tex else ""]
+
+    if addon_prefs.glob_tex and os.path.exists(glob_path):
+        target = glob_path
+    elif os.path.exists(bpy.path.abspath("//")):
+        target = bpy.path.abspath("//")
+    else:
+        target = file.file_path
+    return [f for f in folders if f], target
+
+def ddt_source(file, addon_prefs, texture_name):
+    '''the original .ddt, next to the model or in the AoM installation'''
+    tex_path = os.path.join(file.file_path, texture_name) + '.ddt'
+    if os.path.isfile(tex_path):
+        return tex_path
+    return os.path.join(addon_prefs.aom_path, "textures", texture_name) + '.ddt'
+
+def find_texture(folders, texture_name):
+    '''full path of a readable image of the texture, None if there is none'''
+    for folder in folders:
+        found = texture_index.find(os.path.join(folder, texture_name), IMAGE_EXTS)
+        if found:
+            return found
+    return None
+
+def start_conversion(file, addon_prefs, texture_name):
+    '''convert a texture in the background if there is no readable image yet'''
+    folders, target = texture_folders(file, addon_prefs)
+    source = ddt_source(file, addon_prefs, texture_name)
+    if find_texture(folders, texture_name) or not os.path.isfile(source):
+        return None
+    if addon_prefs.native_ddt:
+        # the pixels are only taken by decode_ddt_image, for an image it doesn't have yet
+        if loaded_images.get(os.path.normcase(os.path.abspath(source))):
+            return None
+        return ddt_pipeline.decode(source)
+    converter = get_converter(addon_prefs)
+    if not converter:
+        return None
+    new_path = os.path.join(target, texture_name) + '.tga'
+    return ddt_pipeline.convert(converter, source, new_path)
+
+def decode_ddt_image(file, addon_prefs, texture_name):
+    '''decode the .ddt in memory and fill a packed image with its pixels'''
+    source = ddt_source(file, addon_prefs, texture_name)
+    key = os.path.normcase(os.path.abspath(source))
+    img = loaded_images.get(key)
+    if img:
+        return img
+    if not os.path.isfile(source):
+        return None
+
+    try:
+        pixels = ddt_pipeline.decode(source).result()
+    except (OSError, DDTError) as e:
+        print("Failed to decode", source, e)
+        return None
+    finally:
+        ddt_pipeline.decodes.pop(source, None)
+
+    height, width = pixels.shape[:2]
+    img = bpy.data.images.new(texture_name, width, height, alpha=True)
+    # blender images start at the bottom row
+    pixels = np.ascontiguousarray(pixels[::-1], dtype=np.float32).ravel()
+    if hasattr(img.pixels, "foreach_set"):
+        img.pixels.foreach_set(pixels)
+    else:
+        img.pixels[:] = pixels.tolist()
+    img.pack(as_png=True)
+    loaded_images.add(key, img)
+    stats.count("textures decoded")
+    return img
+
+def copy_ddt(file, addon_prefs, file_path, texture_name):
+    '''copy the texture from another place, convert it if TextureExtrator is found'''
+    converter = get_converter(addon_prefs)
+    tex_path = ddt_source(file, addon_prefs, texture_name)
+    new_path = os.path.join(file_path, texture_name) + '.tga'
+
+    #try to convert the image from ddt, or wait for a running conversion
+    if converter and os.path.isfile(tex_path):
+        if ddt_pipeline.convert(converter, tex_path, new_path).result():
+            stats.count("textures converted")
+            return get_image(new_path)
+    elif os.path.isfile(new_path): #file already exsists localy
+        return get_image(new_path)
+    else:
+        print("Original .ddt does not exsist or TextureExtractor.exe not found")
+
+    # try ot copy the raw ddt over
+    try:
+        shutil.copy(tex_path, file_path)
+    except (OSError, shutil.Error):
+        pass
+    return None
+
+def load_image(file, addon_prefs, texture_name):
+    '''search for the texture nearby or convert it and load it in blender'''
+    folders, target = texture_folders(file, addon_prefs)
     img = None
 
-    # check for texture exsisting in all possible paths
-    for path in paths:
-        for ext in exts:
-            try:
-                img = bpy.data.images.load(path+ext)
-                print("Image found:", path+ext)
-                return img
-            except RuntimeError:
-                continue
-            else:
-                break
-    print("Still seraching for:", texture_name)
-    # print (file.addon_prefs.glob_tex)
-    # if no readable texture found, try to convert one from ddt
+    # check for texture exsisting in all possible paths, using the folder index
+    found = find_texture(folders, texture_name)
+    if found:
+        img = get_image(found)
+        if img:
+            stats.count("textures found")
+            return img
+
+    # if no readable texture found, decode the ddt or convert it with TextureExtractor
+    if addon_prefs.native_ddt:
+        img = decode_ddt_image(file, addon_prefs, texture_name)
     if not img:
-        if addon_prefs.glob_tex and os.path.exists(glob_path):
-            img = copy_ddt(file, addon_prefs, glob_path, texture_name)
-        else:
-            if os.path.exists(bpy.path.abspath("//")):
-                img = copy_ddt(file, addon_prefs, bpy.path.abspath("//"), texture_name)
-            else:
-                img = copy_ddt(file, addon_prefs, file.file_path, texture_name)
+        img = copy_ddt(file, addon_prefs, target, texture_name)
     # if all else fails let user know
     if not img:
+        stats.count("textures missing")
         print("Can't find %s, add the file to the same folder or specify AoM installation in the preferences" % texture_name)
-        #     print("No local file found, %s.ddt copied over from AoM installation forlder. Use an external tool for conversion." % texture_name)
-        # else:
     return img
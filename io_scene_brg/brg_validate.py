@@ -0,0 +1,182 @@
+import json
+import struct
+from functools import reduce
+from concurrent.futures import ProcessPoolExecutor
+from .brg_util import MeshFlags, MatrFlags
+from .brg_format import BRGReader
+
+'''Structural checks of brg files without building geometry, for whole libraries at once
+
+Only the section headers are read, the arrays of the frames are skipped.'''
+
+# every bit that has a meaning in the flags
+KNOWN_MESH_BITS = reduce(lambda bits, flag: bits | flag.value, MeshFlags, 0)
+KNOWN_MATR_BITS = reduce(lambda bits, flag: bits | flag.value, MatrFlags, 0)
+
+# sections in the order the game writes them, ASET is only there for animations
+SECTION_ORDER = {"BANG": 0, "ASET": 1, "MESI": 2, "MTRL": 3}
+
+class FileCheck:
+    '''the findings of the checks of a single file'''
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.size = 0
+        self.sections = 0
+        self.frames = 0
+        self.vertices = 0
+        self.faces = 0
+        self.materials = 0
+        self.errors = []
+        self.warnings = []
+
+    def error(self, message, *args):
+        self.errors.append(message % args)
+
+    def warning(self, message, *args):
+        self.warnings.append(message % args)
+
+    def as_dict(self):
+        return {"file": self.file_path, "size": self.size, "sections": self.sections,
+                "frames": self.frames, "vertices": self.vertices, "faces": self.faces,
+                "materials": self.materials, "errors": self.errors, "warnings": self.warnings}
+
+def check_order(check, sections):
+    '''the sections start with the file header and follow the order of the game'''
+    if not sections or sections[0].head != "BANG":
+        check.error("file does not start with a BANG section")
+    last = None
+    for section in sections:
+        if last and SECTION_ORDER[section.head] < SECTION_ORDER[last]:
+            check.error("%s section at %d after the %s sections", section.head, section.offset - 4, last)
+        elif section.head == last and section.head in ("BANG", "ASET"):
+            check.error("second %s section at %d", section.head, section.offset - 4)
+        else:
+            last = section.head
+
+def check_end(check, reader, sections, failure):
+    '''the sections cover the whole file. Data after the last known section is skipped by the
+    importer and found in game files too, only a truncated section breaks reading'''
+    file = reader.file
+    end = sections[-1].offset + sections[-1].size if sections else 0
+    if failure is not None:
+        check.error("truncated section after offset %d: %s", end, failure)
+    elif end + 4 <= file.size:
+        file.seek(end)
+        head = file.read_block(4).tobytes()
+        if head.isalpha():
+            check.warning("unknown section %s at %d", head.decode("ascii"), end)
+        else:
+            check.warning("%d trailing bytes at %d", file.size - end, end)
+    elif end < file.size:
+        check.warning("%d trailing bytes at %d", file.size - end, end)
+
+def check_frames(check, frames):
+    '''all frames share the same topology, only the first one holds it'''
+    first = frames[0].header if frames else None
+    for section in frames:
+        frame = section.header
+        check.vertices = max(check.vertices, frame.num_vertices)
+        check.faces = max(check.faces, frame.num_faces)
+        if section is frames[0]:
+            if not frame.first_frame:
+                check.error("first frame has the NOTFIRST flag")
+        elif frame.first_frame:
+            check.error("frame %d has no NOTFIRST flag", section.frame)
+
+        unknown = frame.props.value & ~KNOWN_MESH_BITS & 0xFFFFFFFF
+        if unknown:
+            check.warning("frame %d has unknown mesh flags 0x%08X", section.frame, unknown)
+        if frame.num_vertices != first.num_vertices:
+            check.error("frame %d has %d vertices instead of %d", section.frame,
+                        frame.num_vertices, first.num_vertices)
+        if frame.props.has(MeshFlags.ATTACHPOINTS) != first.props.has(MeshFlags.ATTACHPOINTS):
+            check.error("frame %d does not match the attachpoints of the first frame", section.frame)
+        elif frame.attachpoints and frame.attachpoints.num_matrix != first.attachpoints.num_matrix:
+            check.error("frame %d has %d attachpoints instead of %d", section.frame,
+                        frame.attachpoints.num_matrix, first.attachpoints.num_matrix)
+        if frame.first_frame and frame.num_faces == 0:
+            check.warning("frame %d has no faces", section.frame)
+
+def check_file(file_path):
+    '''check the structure of a file, returns the findings as a dict'''
+    check = FileCheck(file_path)
+    try:
+        reader = BRGReader(file_path)
+    except (IOError, OSError) as e:
+        check.error("can't open: %s", e)
+        return check.as_dict()
+
+    try:
+        check.size = reader.file.size
+        failure = None
+        try:
+            reader.scan_sections()
+        except (struct.error, EOFError) as e:
+            failure = e
+        sections = reader.sections or []
+        check.sections = len(sections)
+        check_order(check, sections)
+        check_end(check, reader, sections, failure)
+
+        frames = [s for s in sections if s.head == "MESI"]
+        check.frames = len(frames)
+        check_frames(check, frames)
+
+        # the counts in the headers match the sections
+        materials = [reader.read_section(s) for s in sections if s.head == "MTRL"]
+        check.materials = len(materials)
+        for section in sections:
+            if section.head == "BANG":
+                header = reader.read_section(section)
+                if header.num_materials != len(materials):
+                    check.error("header has %d materials, file has %d",
+                                header.num_materials, len(materials))
+                if header.num_shape_keys != len(frames):
+                    check.error("header has %d shape keys, file has %d frames",
+                                header.num_shape_keys, len(frames))
+            elif section.head == "ASET":
+                animation = reader.read_section(section)
+                if animation.frames != len(frames):
+                    check.error("animation has %d frames, file has %d",
+                                animation.frames, len(frames))
+                if animation.anim_time <= 0:
+                    check.error("animation time of %g", animation.anim_time)
+        if len(frames) > 1 and not any(s.head == "ASET" for s in sections):
+            check.warning("%d frames without an animation header", len(frames))
+
+        matids = set()
+        for material in materials:
+            if material.matid in matids:
+                check.warning("material id %d is used twice", material.matid)
+            matids.add(material.matid)
+            unknown = material.props.value & ~KNOWN_MATR_BITS & 0xFFFFFFFF
+            if unknown:
+                check.warning("material %d has unknown flags 0x%08X", material.matid, unknown)
+            if material.texture_name is False:
+                check.error("material %d has an unreadable texture name", material.matid)
+    except Exception as e: # a broken file is a finding, not a reason to stop
+        check.error("%s: %s", type(e).__name__, e)
+    finally:
+        reader.close()
+    return check.as_dict()
+
+def check_files(file_paths, workers = 1):
+    '''check files in parallel, yields the findings of every file in order'''
+    if workers < 2:
+        for path in file_paths:
+            yield check_file(path)
+        return
+    # files are small and many, so they are handed out in chunks
+    chunksize = max(1, min(64, len(file_paths) // (workers * 4)))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for result in pool.map(check_file, file_paths, chunksize=chunksize):
+            yield result
+
+def write_report(results, out):
+    '''write the findings as json with a summary, returns the summary'''
+    summary = {"files": len(results),
+               "failed": sum(1 for r in results if r["errors"]),
+               "warned": sum(1 for r in results if r["warnings"] and not r["errors"]),
+               "bytes": sum(r["size"] for r in results)}
+    json.dump({"summary": summary, "files": results}, out, indent=1)
+    return summary
@@ -0,0 +1,129 @@
+import os
+import sys
+import unittest
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from io_scene_brg.brg_format import BRGReader, select_frames, read_file_sections
+from io_scene_brg.brg_parallel import decode_frames
+
+TEST_FILES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "test_files")
+RAVEN = os.path.join(TEST_FILES, "special n raven_birth.brg")
+STATUE = os.path.join(TEST_FILES, "world g statue hades.brg")
+
+def read_all(file_path):
+    '''every parsed section of a file, by head'''
+    reader = BRGReader(file_path)
+    try:
+        records = {}
+        for head, record in reader.read_sections():
+            records.setdefault(head, []).append(record)
+        return records
+    finally:
+        reader.close()
+
+class ReadSectionsTest(unittest.TestCase):
+    def check_file(self, file_path, frames, vertices, faces, materials):
+        records = read_all(file_path)
+        header = records["BANG"][0]
+        self.assertEqual((header.num_materials, header.num_shape_keys), (materials, frames))
+        self.assertEqual(len(records["MESI"]), frames)
+        self.assertEqual(len(records["MTRL"]), materials)
+
+        first = records["MESI"][0]
+        self.assertTrue(first.first_frame)
+        self.assertEqual((first.num_vertices, first.num_faces), (vertices, faces))
+        self.assertEqual(first.faces.shape, (faces, 3))
+        self.assertLess(first.faces.max(), vertices)
+        self.assertEqual(first.uvs.shape, (vertices, 2))
+        for frame_id, frame in enumerate(records["MESI"]):
+            self.assertEqual(frame.frame_id, frame_id)
+            self.assertEqual(frame.vertices.shape, (vertices, 3))
+            self.assertEqual(frame.vertices.dtype, np.float32)
+            self.assertTrue(np.all(np.isfinite(frame.vertices)))
+        return records
+
+    def check_attachpoints(self, frame, first_matrix):
+        points = frame.attachpoints
+        self.assertEqual(points.num_matrix, 2)
+        self.assertEqual(points.matrices.shape, (2, 4, 4))
+        # the rotations are orthonormal and the matrices are affine
+        rotations = points.matrices[:, :3, :3]
+        for rotation in rotations:
+            np.testing.assert_allclose(rotation @ rotation.T, np.eye(3), atol=1e-5)
+        np.testing.assert_array_equal(points.matrices[:, 3], [[0, 0, 0, 1]] * 2)
+        np.testing.assert_allclose(points.matrices[0], first_matrix, atol=1e-6)
+
+    def test_animated_file(self):
+        records = self.check_file(RAVEN, frames=24, vertices=104, faces=92, materials=3)
+        animation = records["ASET"][0]
+        self.assertEqual(animation.frames, 24)
+        self.assertAlmostEqual(animation.anim_time, 4.0)
+        self.assertEqual([m.texture_name for m in records["MTRL"]], ["Special N Raven"] * 3)
+        # only the first frame holds the topology
+        self.assertTrue(all(not f.first_frame for f in records["MESI"][1:]))
+        self.check_attachpoints(records["MESI"][0], [[-1, 0, 0, 0],
+                                                     [0, -1, 0, 0],
+                                                     [0, 0, 1, 1.625],
+                                                     [0, 0, 0, 1]])
+
+    def test_static_file(self):
+        records = self.check_file(STATUE, frames=1, vertices=152, faces=129, materials=2)
+        self.assertNotIn("ASET", records)
+        self.assertEqual([m.matid for m in records["MTRL"]], [1210, 1211])
+        self.check_attachpoints(records["MESI"][0], [[1, 0, 0, 0],
+                                                     [0, 0, -1, 0],
+                                                     [0, 1, 0, 0],
+                                                     [0, 0, 0, 1]])
+
+    def test_scanning_skips_the_arrays(self):
+        reader = BRGReader(RAVEN)
+        try:
+            sections = reader.scan_sections()
+            self.assertEqual([s.head for s in sections[:2]], ["BANG", "ASET"])
+            self.assertEqual([s.frame for s in reader.frame_sections()], list(range(24)))
+            # a frame decoded on demand equals the one of a full read
+            frame = reader.read_frame(5)
+        finally:
+            reader.close()
+        np.testing.assert_array_equal(frame.vertices, read_all(RAVEN)["MESI"][5].vertices)
+
+class FrameRangeTest(unittest.TestCase):
+    def test_select_frames(self):
+        self.assertEqual(select_frames(8), list(range(8)))
+        self.assertEqual(select_frames(8, 2, 5, 2), [1, 3])
+        self.assertEqual(select_frames(8, 1, 0, 3), [0, 3, 6])
+        # ranges past the end keep the last frame
+        self.assertEqual(select_frames(8, 20, 30), [7])
+
+    def test_read_file_sections_in_range(self):
+        sections, seconds = read_file_sections(RAVEN, 2, 5, 2)
+        frames = [record for head, record in sections if head == "MESI"]
+        # the first frame is kept for its faces
+        self.assertEqual([f.frame_id for f in frames], [0, 1, 3])
+        self.assertIsNotNone(frames[0].faces)
+        self.assertEqual(sum(1 for head, record in sections if head == "MTRL"), 3)
+        self.assertGreaterEqual(seconds, 0.0)
+
+        everything = read_all(RAVEN)["MESI"]
+        for frame in frames:
+            np.testing.assert_array_equal(frame.vertices, everything[frame.frame_id].vertices)
+
+class PooledDecodeTest(unittest.TestCase):
+    def test_pool_matches_serial_decoding(self):
+        serial = read_all(RAVEN)["MESI"]
+        reader = BRGReader(RAVEN)
+        try:
+            pooled = list(decode_frames(RAVEN, reader.frame_sections(), 2))
+        finally:
+            reader.close()
+        self.assertEqual(len(pooled), len(serial))
+        for a, b in zip(pooled, serial):
+            self.assertEqual(a.frame_id, b.frame_id)
+            np.testing.assert_array_equal(a.vertices, b.vertices)
+            np.testing.assert_array_equal(a.normals, b.normals)
+            np.testing.assert_array_equal(a.attachpoints.matrices, b.attachpoints.matrices)
+        np.testing.assert_array_equal(pooled[0].faces, serial[0].faces)
+
+if __name__ == "__main__":
+    unittest.main()
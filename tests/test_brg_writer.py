@@ -0,0 +1,91 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from io_scene_brg.brg_format import BRGReader, BRGWriter
+from io_scene_brg.brg_util import BufferedFile
+
+TEST_FILES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "test_files")
+
+def read_sections(file_path):
+    reader = BRGReader(file_path)
+    try:
+        return list(reader.read_sections())
+    finally:
+        reader.close()
+
+def half_bits(values):
+    '''the bits write_half_array writes for float32 bit patterns'''
+    file = BufferedFile(os.path.join(tempfile.gettempdir(), "halves.brg"))
+    file.write_half_array(np.array(values, dtype=np.uint32).view(np.float32))
+    data = np.frombuffer(bytes(file.buffer[:file.offset]), dtype='<u2')
+    file.discard()
+    return data.tolist()
+
+class RoundTripTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def round_trip(self, name):
+        '''write the parsed sections of a file again and read them back'''
+        sections = read_sections(os.path.join(TEST_FILES, name))
+        path = os.path.join(self.folder, name)
+        file = BufferedFile(path)
+        writer = BRGWriter(file)
+        for head, record in sections:
+            writer.write_section(head, record)
+        file.close()
+        self.assertFalse(os.path.exists(path + ".tmp"))
+        return sections, read_sections(path)
+
+    def check_round_trip(self, name):
+        before, after = self.round_trip(name)
+        self.assertEqual([head for head, record in before], [head for head, record in after])
+        for (head, a), (_, b) in zip(before, after):
+            if head == "BANG":
+                self.assertEqual((a.num_materials, a.num_shape_keys),
+                                 (b.num_materials, b.num_shape_keys))
+            elif head == "ASET":
+                self.assertEqual(a.frames, b.frames)
+                self.assertAlmostEqual(a.anim_time, b.anim_time)
+            elif head == "MESI":
+                self.assertEqual(a.props.value, b.props.value)
+                # values read from halves are written back without loss
+                for name in ("vertices", "normals", "uvs", "faces", "face_materials"):
+                    if getattr(a, name) is not None:
+                        np.testing.assert_array_equal(getattr(a, name), getattr(b, name), name)
+                np.testing.assert_allclose(a.attachpoints.matrices, b.attachpoints.matrices, atol=1e-6)
+            elif head == "MTRL":
+                self.assertEqual((a.matid, a.props.value, a.texture_name),
+                                 (b.matid, b.props.value, b.texture_name))
+
+    def test_animated_file(self):
+        self.check_round_trip("special n raven_birth.brg")
+
+    def test_static_file(self):
+        self.check_round_trip("world g statue hades.brg")
+
+class HalfArrayTest(unittest.TestCase):
+    def test_rounding(self):
+        # the upper 16 bits, rounded up from half of the lower bits
+        self.assertEqual(half_bits([0x3F800000, 0x3F807FFF, 0x3F808000, 0xBF80C000]),
+                         [0x3F80, 0x3F80, 0x3F81, 0xBF81])
+
+    def test_no_wrap_to_zero(self):
+        # rounding up 0xFFFF would wrap to zero, nan and inf are cut off instead
+        self.assertEqual(half_bits([0xFFFF8000, 0x7FFFFFFF, 0x7F80C000, 0xFF800000]),
+                         [0xFFFF, 0x7FFF, 0x7F80, 0xFF80])
+
+    def test_no_round_to_infinity(self):
+        # the largest finite values are cut off instead of rounding to inf
+        self.assertEqual(half_bits([0x7F7FFFFF, 0xFF7F8000]), [0x7F7F, 0xFF7F])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,41 @@
+import os
+import sys
+import unittest
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from io_scene_brg.brg_format import FrameKeys
+
+def key_indices(poses, sequence):
+    '''the shapekey index of every frame of a sequence of poses'''
+    keys = FrameKeys()
+    return [keys.add(poses[name].copy())[0] for name in sequence], keys.reused
+
+class FrameKeysTest(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.poses = dict((name, rng.random((8, 3), dtype=np.float32)) for name in "ABC")
+
+    def assert_curve_passes_no_keys(self, indices):
+        # the eval time curve only moves between neighbouring shapekeys
+        for before, after in zip(indices, indices[1:]):
+            self.assertIn(after - before, (0, 1))
+
+    def test_held_frames_share_a_key(self):
+        indices, reused = key_indices(self.poses, "AABBBC")
+        self.assertEqual(indices, [0, 0, 1, 1, 1, 2])
+        self.assertEqual(reused, 3)
+
+    def test_return_to_earlier_pose_adds_a_key(self):
+        indices, reused = key_indices(self.poses, "ABAC")
+        self.assertEqual(indices, [0, 1, 2, 3])
+        self.assertEqual(reused, 0)
+        self.assert_curve_passes_no_keys(indices)
+
+    def test_mixed_sequence(self):
+        indices, reused = key_indices(self.poses, "AABAACCA")
+        self.assert_curve_passes_no_keys(indices)
+        self.assertEqual(reused, 3)
+
+if __name__ == "__main__":
+    unittest.main()